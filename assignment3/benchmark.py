@@ -0,0 +1,145 @@
+import argparse
+import datetime
+import io
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from lexer import Lexer
+from parser import Parser
+from program_generator import ProgramGenerator
+from vm import VM
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+
+def reset_peak_rss():
+    # Linux lets a process reset its own high-water mark; elsewhere the
+    # peak is process-wide and only ever grows
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def measure(run):
+    """
+    Calls run() and returns (result, seconds, peak RSS in KB while it ran).
+    """
+    reset_peak_rss()
+    start = time.perf_counter()
+    result = run()
+    seconds = time.perf_counter() - start
+    return result, seconds, peak_rss_kb()
+
+
+def rate(count, seconds):
+    return count / seconds if seconds > 0 else None
+
+
+def benchmark_program(source, statements, run_vm=True):
+    """
+    Times each pipeline stage over one generated program: lex, parse (which
+    includes code generation), writing the listing and running it on the VM.
+    """
+    tokens, lex_seconds, lex_rss = measure(lambda: Lexer(source).lex())
+
+    parser = Parser(tokens)
+    _, parse_seconds, parse_rss = measure(parser.rat25f)
+    instructions = len(parser.instr_table)
+
+    _, listing_seconds, listing_rss = measure(parser.listing_text)
+
+    stages = {
+        'lex': {'seconds': lex_seconds, 'peak_rss_kb': lex_rss,
+                'tokens_per_sec': rate(len(tokens), lex_seconds)},
+        'parse': {'seconds': parse_seconds, 'peak_rss_kb': parse_rss,
+                  'tokens_per_sec': rate(len(tokens), parse_seconds),
+                  'statements_per_sec': rate(statements, parse_seconds),
+                  'instructions_per_sec': rate(instructions, parse_seconds)},
+        'listing': {'seconds': listing_seconds, 'peak_rss_kb': listing_rss,
+                    'instructions_per_sec': rate(instructions, listing_seconds)},
+    }
+    if run_vm:
+        vm = VM(parser.instr_table, stdin=itertools.repeat("3 5 7\n"), stdout=io.StringIO())
+        _, vm_seconds, vm_rss = measure(vm.run)
+        stages['vm'] = {'seconds': vm_seconds, 'peak_rss_kb': vm_rss}
+
+    return {
+        'source_bytes': len(source),
+        'tokens': len(tokens),
+        'statements': statements,
+        'instructions': instructions,
+        'stages': stages,
+    }
+
+
+def git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def print_results(size, result):
+    print(f"{size} statements: {result['tokens']} tokens, "
+          f"{result['instructions']} instructions, {result['source_bytes']} bytes")
+    for stage, numbers in result['stages'].items():
+        rates = "  ".join(f"{name[:-8]}/s={value:,.0f}"
+                          for name, value in numbers.items()
+                          if name.endswith('_per_sec') and value is not None)
+        print(f"  {stage:<8} {numbers['seconds']:8.3f}s  "
+              f"peak {numbers['peak_rss_kb'] / 1024:7.1f} MB  {rates}")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(
+        description="Benchmark the lexer, parser, listing and VM on generated programs.")
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                            help="program sizes in statements")
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--no-vm', action='store_true',
+                            help="skip running the generated programs")
+    arg_parser.add_argument('-o', '--output', help="write the results as JSON to this file")
+    args = arg_parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        generator = ProgramGenerator(args.seed)
+        source = generator.generate(size)
+        result = benchmark_program(source, generator.statement_count, not args.no_vm)
+        result['seed'] = args.seed
+        results.append(result)
+        print_results(size, result)
+
+    if args.output:
+        report = {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,198 @@
+from instructions import real_to_oprnd
+from parser import Parser
+from symbol_table import INTEGER, REAL, TYPE_NAMES, assignable
+import syntax_tree
+
+
+class CodeGenerator(Parser):
+    """
+    Emits the instruction table for a syntax_tree.Program. It does the
+    declarations, lookups and type checks the direct parser does as it
+    recognizes, in the same order and with the same emit helpers, so the
+    table, symbol table and error messages come out identical.
+
+    Each visit method returns what the matching grammar rule returns:
+    expressions give the type code of the value their code leaves on the
+    stack. Errors are reported at the token the direct parser would be
+    looking at, which the nodes keep.
+    """
+
+    def __init__(self, fold_constants=False, source=None):
+        super().__init__((), fold_constants=fold_constants, source=source)
+        self.visitors = {
+            syntax_tree.Compound: self.visit_compound,
+            syntax_tree.Assign: self.visit_assign,
+            syntax_tree.If: self.visit_if,
+            syntax_tree.Return: self.visit_return,
+            syntax_tree.Print: self.visit_print,
+            syntax_tree.Scan: self.visit_scan,
+            syntax_tree.While: self.visit_while,
+            syntax_tree.Binary: self.visit_binary,
+            syntax_tree.Negate: self.visit_negate,
+            syntax_tree.Name: self.visit_name,
+            syntax_tree.Call: self.visit_call,
+            syntax_tree.Constant: self.visit_constant,
+        }
+
+    def visit(self, node):
+        return self.visitors[type(node)](node)
+
+    def generate(self, program):
+        if program.functions:
+            # Function code comes first; jump over it to the main program
+            self.jump_stack.append(self.gen_instr('JUMP', None))
+            for function in program.functions:
+                self.visit_function(function)
+            for function in self.symbol_table.functions.values():
+                if function.entry is None:
+                    self.error(f"Function '{function.name}' not defined.", function.calls[0][2])
+            self.back_patch(self.instr_address)
+        self.declare(program.declarations)
+        for statement in program.statements:
+            self.visit(statement)
+
+    def declare(self, declarations):
+        for declaration in declarations:
+            for lexeme, position, token in declaration.names:
+                self.current_token = token
+                self.insert_symbol(lexeme, declaration.type, position)
+
+    def visit_function(self, node):
+        name = node.token[1]
+        function = self.symbol_table.function(name)
+        if function.entry is not None:
+            self.error(f"Function '{name}' already defined.", node.token)
+        function.position = node.position
+        self.symbol_table.enter_scope(name)
+        self.declare(node.parameters)
+        function.param_types = self.symbol_table.scope_types()
+        self.declare(node.declarations)
+
+        # Prologue, as in Parser.function
+        function.entry = self.gen_instr('ENTER', self.symbol_table.scope_size())
+        for offset in reversed(range(len(function.param_types))):
+            self.gen_instr('POPLR' if function.param_types[offset] == REAL else 'POPL', offset)
+        for call_addr, arg_types, token, arg_ends in function.calls:
+            self.check_arguments(function, arg_types, arg_ends, token)
+            self.instr_table.set_oprnd(call_addr, function.entry)
+        function.calls.clear()
+
+        self.current_function = function
+        self.visit_compound(node.body)
+        self.gen_return_zero()
+        self.gen_instr('RET', None)
+        self.current_function = None
+        self.symbol_table.exit_scope()
+
+    # --- Statements ---
+
+    def visit_compound(self, node):
+        for statement in node.statements:
+            self.visit(statement)
+
+    def visit_assign(self, node):
+        self.current_token = node.token
+        symbol = self.get_symbol(node.token[1])
+        type_ = self.visit(node.value)
+        if type_ != symbol.type_code and not assignable(symbol.type_code, type_):
+            self.error(f"Type mismatch: cannot assign {TYPE_NAMES[type_]} to {symbol.type} '{symbol.name}'.",
+                       node.token)
+        self.expect_type(type_, self.instr_address, symbol.type_code, node.token)
+        self.gen_store(symbol)
+
+    def visit_if(self, node):
+        self.visit_condition(node.condition)
+        self.jump_stack.append(self.gen_instr('JUMPZ', None))
+        self.visit(node.then)
+        if node.orelse is not None:
+            jump_addr = self.gen_instr('JUMP', None)
+            self.back_patch(self.instr_address)
+            self.jump_stack.append(jump_addr)
+            self.visit(node.orelse)
+        self.back_patch(self.instr_address)
+
+    def visit_return(self, node):
+        if node.value is None:
+            self.gen_return_zero()
+        else:
+            self.gen_return_value(self.visit(node.value), node.token)
+        self.gen_instr('RET', None)
+
+    def visit_print(self, node):
+        self.visit(node.value)
+        self.gen_instr('STDOUT', None)
+
+    def visit_scan(self, node):
+        for token in node.tokens:
+            self.current_token = token
+            symbol = self.get_symbol(token[1])
+            self.gen_instr('STDINR' if symbol.type_code == REAL else 'STDIN', None)
+            self.gen_store(symbol)
+
+    def visit_while(self, node):
+        addr_start = self.gen_instr('LABEL', None)
+        self.visit_condition(node.condition)
+        self.jump_stack.append(self.gen_instr('JUMPZ', None))
+        self.visit(node.body)
+        self.gen_instr('JUMP', addr_start)
+        self.back_patch(self.instr_address)
+
+    def visit_condition(self, node):
+        left_type = self.visit(node.left)
+        right_addr = self.instr_address
+        right_type = self.visit(node.right)
+        self.gen_compare(node.op, left_type, right_type, right_addr, node.token)
+
+    # --- Expressions ---
+
+    def visit_binary(self, node):
+        # a + b + c nests to the left, so the chain is walked down its left
+        # spine with a loop, as the expression and term rules do, and long
+        # chains do not grow the Python stack. The operands' start
+        # addresses let gen_binary fold constants.
+        spine = []
+        while type(node) is syntax_tree.Binary:
+            spine.append(node)
+            node = node.left
+        left_addr = self.instr_address
+        left_type = self.visit(node)
+        for node in reversed(spine):
+            right_addr = self.instr_address
+            right_type = self.visit(node.right)
+            left_type = self.gen_arith(node.op, left_addr, right_addr, left_type, right_type, node.token)
+        return left_type
+
+    def visit_negate(self, node):
+        left_addr = self.gen_instr('PUSHI', 0)
+        type_ = self.visit(node.operand)
+        return self.gen_arith('SUB', left_addr, left_addr + 1, INTEGER, type_, node.token)
+
+    def visit_name(self, node):
+        symbol = self.symbol_table.lookup(node.token[1])
+        if symbol is None:
+            self.error(f"Identifier '{node.token[1]}' not declared.", node.token)
+        self.gen_load(symbol)
+        return symbol.type_code
+
+    def visit_call(self, node):
+        function = self.symbol_table.function(node.token[1])
+        arg_types = []
+        arg_ends = []
+        for argument in node.arguments:
+            arg_types.append(self.visit(argument))
+            arg_ends.append(self.instr_address)
+        call_addr = self.gen_instr('CALL', function.entry)
+        if function.entry is not None:
+            self.check_arguments(function, arg_types, arg_ends, node.token)
+        elif self.symbol_table.scopes:
+            function.calls.append((call_addr, arg_types, node.token, arg_ends))
+        else:
+            self.error(f"Function '{function.name}' not defined.", node.token)
+        return self.call_result(function, call_addr)
+
+    def visit_constant(self, node):
+        if node.type == REAL:
+            self.gen_instr('PUSHR', real_to_oprnd(node.value))
+        else:
+            self.gen_instr('PUSHI', node.value)
+        return node.type
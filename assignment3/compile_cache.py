@@ -0,0 +1,108 @@
+import hashlib
+import os
+
+# Compiler sources hashed into the version stamp, so editing any of them
+# invalidates every cached result
+COMPILER_FILES = ('lexer.py', 'parser.py', 'instructions.py', 'peephole.py', 'symbol_table.py',
+                  'syntax_tree.py', 'codegen.py')
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'rat25')
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Bytes hashed per read when keying a source file
+READ_SIZE = 1024 * 1024
+
+_compiler_version = None
+
+
+def compiler_version():
+    # SHA-256 over the compiler sources, computed once per process
+    global _compiler_version
+    if _compiler_version is None:
+        digest = hashlib.sha256()
+        base = os.path.dirname(os.path.abspath(__file__))
+        for name in COMPILER_FILES:
+            with open(os.path.join(base, name), 'rb') as f:
+                digest.update(f.read())
+        _compiler_version = digest.hexdigest()
+    return _compiler_version
+
+
+class CompileCache:
+    """
+    On-disk cache of compile results keyed by a hash of the source bytes,
+    the compiler version stamp and the compile options. An entry holds the
+    text Parser.parse wrote to the .out file: the instruction and symbol
+    tables, or the error message. Entries are files whose modification time
+    records their last use; evict() drops the least recently used ones until
+    the cache fits in max_bytes.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, file_path, options=''):
+        digest = hashlib.sha256()
+        digest.update(compiler_version().encode())
+        digest.update(options.encode())
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(READ_SIZE), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key + '.out')
+
+    def get(self, key):
+        path = self.entry_path(key)
+        try:
+            with open(path, 'r') as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        # Mark as recently used
+        os.utime(path)
+        return text
+
+    def put(self, key, text):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.entry_path(key)
+        # Write then rename so concurrent workers never see a partial entry
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(text)
+        os.replace(temp_path, path)
+
+    def evict(self):
+        # Removes least recently used entries until the cache fits;
+        # returns how many were removed
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+        entries = []
+        total = 0
+        for name in names:
+            if not name.endswith('.out'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        removed = 0
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
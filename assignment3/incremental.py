@@ -0,0 +1,741 @@
+import argparse
+import random
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from operator import attrgetter, itemgetter
+from instructions import InstrTable, OPCODE_CODES
+from lexer import Lexer, LineIndex
+from parser import Parser, error_text, starts_statement
+
+# Segment kinds: the program head (function definitions, '#' and
+# declarations), one top-level statement of the main program, and the
+# closing '#'. Tokens after the end are kept in DIRTY statement segments
+# that are never parsed while the end stands.
+PREFIX, STATEMENT, END = 'prefix', 'statement', 'end'
+
+# Segment states. DIRTY segments have not been parsed since their tokens,
+# or a function signature they depend on, changed.
+OK, ERROR, DIRTY = 'ok', 'error', 'dirty'
+
+# Most tokens put in one DIRTY segment by an edit
+DIRTY_RUN = 256
+
+JUMP_CODES = {OPCODE_CODES['JUMP'], OPCODE_CODES['JUMPZ']}
+CALL_CODE = OPCODE_CODES['CALL']
+
+segment_start = attrgetter('start')
+token_end = itemgetter(4)
+
+
+class Segment:
+    """
+    A run of tokens parsed as one unit. Token lines and offsets are stored
+    relative to line and start, the position of the segment's first token,
+    so an edit elsewhere moves a segment without touching its tokens.
+
+    A statement's code is its own instruction table, addressed from 1, and
+    relocs lists (index, None) for each jump to relocate and (index, name)
+    for each CALL, whose target is looked up when the program is assembled.
+    calls holds the names the statement calls, so a change to one of those
+    functions' signatures marks it DIRTY. error is (message, token index or
+    None, text), text being set for errors not raised by Parser.error.
+    """
+    __slots__ = ('kind', 'tokens', 'start', 'line', 'state', 'code', 'relocs', 'calls', 'error')
+
+    def __init__(self, kind, tokens, start, line, state=DIRTY):
+        self.kind = kind
+        self.tokens = tokens
+        self.start = start
+        self.line = line
+        self.state = state
+        self.code = None
+        self.relocs = None
+        self.calls = ()
+        self.error = None
+
+
+def relative(tokens, start, line):
+    return [(kind, lexeme, token_line - line, token_start - start, token_end - start)
+            for kind, lexeme, token_line, token_start, token_end in tokens]
+
+
+def called_names(tokens):
+    # Identifiers followed by '(', which the parser takes as calls
+    return frozenset(tokens[index][1] for index in range(len(tokens) - 1)
+                     if tokens[index][0] == 'IDENTIFIER' and tokens[index + 1][1] == '(')
+
+
+class Document:
+    """
+    A source buffer kept compiled across edits, for editors that recompile
+    on every keystroke:
+
+        document = Document(source)
+        document.edit(offset, deleted_length, inserted_text)
+        document.error            # None, or the message a full compile gives
+        document.instr_table()    # same table as a full compile
+
+    Edits only re-lex; parsing waits until a result is asked for, so a
+    burst of edits is parsed once.
+
+    The tokens are split into Segments: the program head, each top-level
+    statement of the main program and the end. An edit re-lexes from the
+    last token before it until new tokens start where old ones did, which
+    from then on must be the same tokens. Only the segments holding changed
+    tokens are parsed again, and parsing stops as soon as a statement ends
+    where an unchanged segment starts. Main statements depend on nothing but
+    the head's symbol table, so unchanged ones keep their code; statements
+    are relocated and calls resolved when the table is assembled.
+
+    Segments after the one an edit changed are shifted lazily: those from
+    gap on store their start and line less shift and line_shift, and moving
+    the gap costs the number of segments between consecutive edits.
+    """
+
+    def __init__(self, source, fold_constants=False):
+        self.source = source
+        self.ascii = source.isascii()
+        self.fold_constants = fold_constants
+        tokens = Lexer(source).lex()
+        start, line = (tokens[0][3], tokens[0][2]) if tokens else (0, 1)
+        self.segments = [Segment(PREFIX, relative(tokens, start, line), start, line)]
+        self.gap = 1
+        self.shift = 0
+        self.line_shift = 0
+        # Segments that are not OK
+        self.bad = {self.segments[0]}
+        # The END segment once it has parsed. The compiler ignores the
+        # tokens after it, so segments past it are not parsed.
+        self.end = None
+        self.symbol_table = None
+        # (globals, {function: (return type, parameter types)}) of the last
+        # head that parsed, which main statements are checked against
+        self.signature = None
+        # Function name at each entry address, for CALL relocations
+        self.entry_names = {}
+        self.table = None
+        self.settle()
+
+    # --- Positions ---
+
+    def base(self, index):
+        # True (start, line) of a segment
+        segment = self.segments[index]
+        if index >= self.gap:
+            return segment.start + self.shift, segment.line + self.line_shift
+        return segment.start, segment.line
+
+    def move_gap(self, index):
+        # Stores the true start and line of every segment before index
+        segments = self.segments
+        shift, line_shift = self.shift, self.line_shift
+        if shift or line_shift:
+            if index > self.gap:
+                for position in range(self.gap, index):
+                    segment = segments[position]
+                    segment.start += shift
+                    segment.line += line_shift
+            else:
+                for position in range(index, self.gap):
+                    segment = segments[position]
+                    segment.start -= shift
+                    segment.line -= line_shift
+        self.gap = index
+
+    def index_of(self, segment):
+        # Position of a segment in segments, by a binary search on its start
+        segments = self.segments
+        for low, high in ((0, self.gap), (self.gap, len(segments))):
+            index = bisect_left(segments, segment.start, low, high, key=segment_start)
+            while index < high and segments[index].start == segment.start:
+                if segments[index] is segment:
+                    return index
+                index += 1
+        raise ValueError("Segment not in document")
+
+    def find_segment(self, offset):
+        # Index of the last segment starting at or before offset
+        segments = self.segments
+        index = bisect_right(segments, offset, 0, self.gap, key=segment_start)
+        if index == self.gap:
+            index = bisect_right(segments, offset - self.shift, self.gap, len(segments), key=segment_start)
+        return max(index - 1, 0)
+
+    def token_before(self, offset):
+        # (segment index, token index) of the last token ending before
+        # offset, or None
+        index = self.find_segment(offset)
+        while index >= 0:
+            start, _ = self.base(index)
+            position = bisect_left(self.segments[index].tokens, offset - start, key=token_end)
+            if position:
+                return index, position - 1
+            index -= 1
+        return None
+
+    def absolute(self, index, first=0, end=None):
+        # Tokens first:end of a segment, with true lines and offsets
+        start, line = self.base(index)
+        return [(kind, lexeme, token_line + line, token_start + start, token_end + start)
+                for kind, lexeme, token_line, token_start, token_end in self.segments[index].tokens[first:end]]
+
+    def tokens_from(self, index, first):
+        # (segment index, token index, token) from a position to the end
+        segments = self.segments
+        while index < len(segments):
+            for position, token in enumerate(self.absolute(index, first), first):
+                yield index, position, token
+            index += 1
+            first = 0
+
+    def tokens(self):
+        # Every token, as Lexer.lex would give them
+        return [token for _, _, token in self.tokens_from(0, 0)]
+
+    # --- Edits ---
+
+    def edit(self, offset, deleted, inserted):
+        """
+        Replaces deleted characters at offset with inserted. The changed
+        segments are parsed when a result is next asked for.
+        """
+        source = self.source
+        if not 0 <= offset <= offset + deleted <= len(source):
+            raise ValueError(f"Edit out of range: {offset}+{deleted} in {len(source)} characters")
+        delta = len(inserted) - deleted
+        line_delta = inserted.count('\n') - source.count('\n', offset, offset + deleted)
+        source = self.source = source[:offset] + inserted + source[offset + deleted:]
+        self.ascii = self.ascii and inserted.isascii()
+        self.table = None
+
+        # Rescan from the end of the last token before the edit. A new token
+        # past the inserted text that starts where an old one started (less
+        # delta) is followed by the same tokens as before.
+        before = self.token_before(offset)
+        if before is None:
+            restart, line, resume = 0, 1, (0, 0)
+        else:
+            token = self.absolute(before[0], before[1], before[1] + 1)[0]
+            restart, line, resume = token[4], token[2], (before[0], before[1] + 1)
+        old = self.tokens_from(*resume)
+        old_item = next(old, None)
+        first_old = old_item
+        inserted_end = offset + len(inserted)
+        new_tokens = []
+        lexer = Lexer(source, 'regex' if self.ascii else 'fsm')
+        for token in lexer.scanFrom(restart, line):
+            if token[3] >= inserted_end:
+                old_start = token[3] - delta
+                while old_item is not None and old_item[2][3] < old_start:
+                    old_item = next(old, None)
+                if old_item is not None and old_item[2][3] == old_start:
+                    break
+            new_tokens.append(token)
+        else:
+            old_item = None
+
+        if old_item is first_old and not new_tokens:
+            # Same tokens: only positions after the edit move
+            self.shift_from(old_item, delta, line_delta)
+        else:
+            self.splice(first_old, old_item, new_tokens, delta, line_delta)
+            if before is None or before[0] == 0:
+                # The head's parse looks at the token after it
+                self.mark_dirty(self.segments[0])
+
+    def shift_from(self, item, delta, line_delta):
+        # Moves the tokens from item on by delta characters and line_delta lines
+        if item is None:
+            self.move_gap(len(self.segments))
+        else:
+            index, position = item[0], item[1]
+            if position:
+                segment = self.segments[index]
+                tokens = segment.tokens
+                tokens[position:] = [(kind, lexeme, token_line + line_delta, token_start + delta, token_end + delta)
+                                     for kind, lexeme, token_line, token_start, token_end in tokens[position:]]
+                index += 1
+            self.move_gap(index)
+        self.shift += delta
+        self.line_shift += line_delta
+
+    def splice(self, first_old, resync, new_tokens, delta, line_delta):
+        # Replaces the old tokens from first_old up to resync (None for the
+        # end) with new_tokens, in DIRTY segments
+        segments = self.segments
+        if resync is not None:
+            resync_index, resync_position = resync[0], resync[1]
+        else:
+            resync_index, resync_position = len(segments), 0
+        if first_old is not resync:
+            first, head_end = first_old[0], first_old[1]
+            last = resync_index if resync_position else resync_index - 1
+        elif resync_position or resync is None:
+            # Insertion inside a segment, or after the last token
+            first = min(resync_index, len(segments) - 1)
+            head_end = resync_position if resync is not None else len(segments[first].tokens)
+            last = first
+        elif resync_index:
+            # Insertion between two segments gets a segment of its own
+            first, head_end, last = resync_index, 0, resync_index - 1
+        else:
+            # ...except before the head, which always comes first
+            first, head_end, last = 0, 0, 0
+
+        tokens = self.absolute(first, 0, head_end) if first <= last else []
+        tokens += new_tokens
+        if resync is not None and last == resync_index:
+            tokens += [(kind, lexeme, token_line + line_delta, token_start + delta, token_end + delta)
+                       for kind, lexeme, token_line, token_start, token_end in self.absolute(last, resync_position)]
+        # Long runs are cut into several segments, so the next edit in them
+        # has fewer tokens to move
+        kind = segments[first].kind if first < len(segments) and first <= last else STATEMENT
+        replacement = []
+        for position in range(0, len(tokens), DIRTY_RUN):
+            run = tokens[position:position + DIRTY_RUN]
+            start, line = run[0][3], run[0][2]
+            replacement.append(Segment(kind if not position else STATEMENT, relative(run, start, line), start, line))
+
+        self.move_gap(last + 1)
+        self.forget(segments[first:last + 1])
+        segments[first:last + 1] = replacement
+        self.gap = first + len(replacement)
+        self.shift += delta
+        self.line_shift += line_delta
+        if replacement:
+            self.bad.update(replacement)
+        elif segments:
+            # Every token of the segments went: parse again from the one
+            # that now follows them
+            self.mark_dirty(segments[min(first, len(segments) - 1)])
+        else:
+            self.segments = [Segment(PREFIX, [], 0, 1)]
+            self.gap, self.shift, self.line_shift = 1, 0, 0
+            self.bad = {self.segments[0]}
+
+    def forget(self, removed):
+        # Drops segments about to be removed from the bookkeeping
+        for segment in removed:
+            self.bad.discard(segment)
+            if segment is self.end:
+                self.end = None
+
+    def mark_dirty(self, segment):
+        segment.state = DIRTY
+        self.bad.add(segment)
+
+    # --- Parsing ---
+
+    def settle(self):
+        # Parses from the first segment that is not OK while that one is
+        # DIRTY. A full compile stops at the first error, so segments after
+        # an ERROR are left as they are until it is fixed.
+        while self.bad:
+            index = min(map(self.index_of, self.bad))
+            if self.segments[index].state != DIRTY or self.past_end(index):
+                break
+            self.parse_from(index)
+
+    def past_end(self, index):
+        return self.end is not None and index > self.index_of(self.end)
+
+    def stream(self, index, collected, entries):
+        # The tokens from segment index on, collected as they are handed
+        # out; entries maps a stream position to the segment starting there
+        segments = self.segments
+        for position in range(index, len(segments)):
+            entries.setdefault(len(collected), position)
+            for token in self.absolute(position):
+                collected.append(token)
+                yield token
+        entries.setdefault(len(collected), len(segments))
+
+    def parse_from(self, index):
+        segments = self.segments
+        collected = []
+        entries = {}
+        parser = Parser(self.stream(index, collected, entries), fold_constants=self.fold_constants)
+        new = []
+        resync = True
+
+        def reusable(position):
+            # The unchanged segment starting at a stream position, where
+            # parsing can stop, or None
+            target = entries.get(position)
+            if target is None or target <= index or target == len(segments):
+                return None
+            segment = segments[target]
+            if segment.state == DIRTY or segment.kind == PREFIX:
+                return None
+            # Parsed as the first statement, which is not optional, from
+            # something that would otherwise end the statement list
+            if segment.kind == STATEMENT and not (segment.tokens and starts_statement(segment.tokens[0])):
+                return None
+            return target
+
+        def pull(position):
+            # Hands out tokens until the one at position, if there is one
+            while len(collected) <= position and next(parser.token_iter, None) is not None:
+                pass
+            return position < len(collected)
+
+        if index == 0:
+            try:
+                parser.program_head()
+            except Exception as e:
+                # Statements keep what they were parsed against, the last
+                # head that parsed, until this one is fixed
+                new.append(self.error_segment(PREFIX, collected, 0, parser, e))
+                stop = self.dirty_rest(new, collected, parser.pos + 1, entries, pull, False)
+                self.replace(index, stop, new)
+                return
+            new.append(self.ok_segment(PREFIX, collected, 0, parser.pos, parser.instr_table))
+            resync = self.update_signature(parser)
+            first = True
+            if resync:
+                target = reusable(parser.pos)
+                if target is not None and segments[target].kind == STATEMENT:
+                    self.replace(index, target, new)
+                    return
+        else:
+            parser.symbol_table = self.symbol_table
+            first = index == 1
+
+        while True:
+            start = parser.pos
+            if not first and not parser.at_statement_start():
+                # The segments after the end stay as they are, for when a
+                # stray '#' is removed, unless the globals changed
+                try:
+                    parser.program_end()
+                    self.end = self.ok_segment(END, collected, start, parser.pos, None)
+                    new.append(self.end)
+                    stop = self.dirty_rest(new, collected, parser.pos, entries, pull, not resync)
+                except Exception as e:
+                    new.append(self.error_segment(END, collected, start, parser, e))
+                    stop = self.dirty_rest(new, collected, parser.pos + 1, entries, pull, not resync)
+                break
+            first = False
+            parser.instr_table = InstrTable()
+            parser.instr_address = 1
+            parser.error_at = None
+            try:
+                parser.statement()
+            except Exception as e:
+                new.append(self.error_segment(STATEMENT, collected, start, parser, e))
+                stop = self.dirty_rest(new, collected, parser.pos + 1, entries, pull, not resync)
+                break
+            new.append(self.ok_segment(STATEMENT, collected, start, parser.pos, parser.instr_table))
+            if resync:
+                stop = reusable(parser.pos)
+                if stop is not None:
+                    break
+        self.replace(index, stop, new)
+
+    def update_signature(self, parser):
+        # Takes the symbol table of a head that parsed. Returns whether the
+        # main statements parsed against the previous one still stand; if
+        # only some functions changed, their callers are marked DIRTY.
+        symbol_table = parser.symbol_table
+        self.symbol_table = symbol_table
+        self.entry_names = {function.entry: name for name, function in symbol_table.functions.items()
+                            if function.entry is not None}
+        globals_ = tuple((symbol.name, symbol.type) for symbol in symbol_table)
+        functions = {name: (function.type, tuple(function.param_types))
+                     for name, function in symbol_table.functions.items() if function.entry is not None}
+        old = self.signature
+        self.signature = (globals_, functions)
+        if old is None or old[0] != globals_:
+            return False
+        if old[1] != functions:
+            changed = {name for name in old[1].keys() | functions.keys()
+                       if old[1].get(name) != functions.get(name)}
+            for segment in self.segments:
+                if segment.kind == STATEMENT and segment.state != DIRTY and not changed.isdisjoint(segment.calls):
+                    self.mark_dirty(segment)
+        return True
+
+    def ok_segment(self, kind, collected, first, end, table):
+        segment = self.new_segment(kind, collected, first, end, OK)
+        if kind == STATEMENT:
+            ops = table.ops
+            relocs = []
+            for position, code in enumerate(ops):
+                if code in JUMP_CODES:
+                    relocs.append((position, None))
+                elif code == CALL_CODE:
+                    relocs.append((position, self.entry_names[table.oprnds[position]]))
+            segment.code = table
+            segment.relocs = relocs
+        elif kind == PREFIX:
+            segment.code = table
+        return segment
+
+    def error_segment(self, kind, collected, first, parser, exception, end=None):
+        # The error depends on the tokens up to the parser's current one
+        if end is None:
+            end = min(parser.pos + 1, len(collected))
+        segment = self.new_segment(kind, collected, first, end, ERROR)
+        if parser.error_at is None:
+            segment.error = (None, None, str(exception))
+        else:
+            message, token = parser.error_at
+            position = collected.index(token, first, end) - first if token else None
+            segment.error = (message, position, None)
+        return segment
+
+    def new_segment(self, kind, collected, first, end, state):
+        tokens = collected[first:end]
+        if tokens:
+            start, line = tokens[0][3], tokens[0][2]
+        elif collected:
+            start, line = collected[-1][4], collected[-1][2]
+        else:
+            start, line = len(self.source), 1
+        segment = Segment(kind, relative(tokens, start, line), start, line, state)
+        if kind == STATEMENT:
+            segment.calls = called_names(tokens)
+        return segment
+
+    def add_dirty(self, new, collected, first, end, entries):
+        # DIRTY segments for the stream from first to end, split where the
+        # old segments started so a later edit re-lexes no more than before
+        end = min(end, len(collected))
+        cuts = sorted(position for position in entries if first < position < end)
+        for cut in cuts + [end]:
+            if first < cut:
+                new.append(self.new_segment(STATEMENT, collected, first, cut, DIRTY))
+            first = cut
+
+    def dirty_rest(self, new, collected, first, entries, pull, mark):
+        # Ends a parse that stopped at an error or the end: the tokens up to
+        # the next old segment become DIRTY segments, and its index is
+        # returned. The old segments from there on are kept as they are,
+        # or with mark, when they depended on what changed, marked DIRTY.
+        position = first
+        while pull(position) and position not in entries:
+            position += 1
+        self.add_dirty(new, collected, first, position, entries)
+        stop = entries.get(position, len(self.segments))
+        if mark:
+            for segment in self.segments[stop:]:
+                if segment.state != DIRTY:
+                    self.mark_dirty(segment)
+        return stop
+
+    def replace(self, index, stop, new):
+        # Puts the new segments in place of segments[index:stop]
+        segments = self.segments
+        self.move_gap(stop)
+        self.forget(segments[index:stop])
+        segments[index:stop] = new
+        self.gap += len(new) - (stop - index)
+        for segment in new:
+            if segment.state != OK:
+                self.bad.add(segment)
+
+    # --- Results ---
+
+    def first_error(self):
+        # (message, token or None, text) of the error a full compile stops
+        # at, as Segment.error but with the token itself, or None
+        self.settle()
+        # After settle() the first segment that is not OK, if any, is an
+        # ERROR: everything before it parsed
+        if not self.bad:
+            return None
+        index = min(map(self.index_of, self.bad))
+        if self.past_end(index):
+            return None
+        message, position, text = self.segments[index].error
+        token = self.absolute(index, position, position + 1)[0] if position is not None else None
+        return message, token, text
+
+    @property
+    def error(self):
+        # The message a full compile of the source would raise, or None
+        found = self.first_error()
+        if found is None:
+            return None
+        message, token, text = found
+        if text is not None:
+            return text
+        return error_text(message, token, LineIndex(self.source))
+
+    def diagnostic(self):
+        """
+        (message, token) for the compile error, or None: the message as
+        error words it but without the quoted source line, and the token it
+        is reported at, None at the end of the file.
+        """
+        found = self.first_error()
+        if found is None:
+            return None
+        message, token, text = found
+        return (text, None) if text is not None else (error_text(message, token), token)
+
+    def instr_table(self):
+        """
+        The program's instruction table, assembled from the head's code and
+        each statement's. Raises the compile error if there is one.
+        """
+        if self.table is not None:
+            return self.table
+        error = self.error
+        if error is not None:
+            raise Exception(error)
+        head = self.segments[0].code
+        table = InstrTable.from_codes(head.ops, head.oprnds)
+        ops, oprnds = table.ops, table.oprnds
+        entries = {name: function.entry for name, function in self.symbol_table.functions.items()}
+        for segment in self.segments:
+            if segment.kind == END:
+                break
+            if segment.kind != STATEMENT:
+                continue
+            base = len(ops)
+            ops.extend(segment.code.ops)
+            oprnds.extend(segment.code.oprnds)
+            for position, name in segment.relocs:
+                if name is None:
+                    oprnds[base + position] += base
+                else:
+                    oprnds[base + position] = entries[name]
+        self.table = table
+        return table
+
+    # --- Symbols ---
+
+    def token_at(self, offset):
+        # (segment index, token index, token) of the token holding the
+        # character at offset, else of one ending right before it, or None
+        index = self.find_segment(offset)
+        start, _ = self.base(index)
+        tokens = self.segments[index].tokens
+        position = bisect_right(tokens, offset - start, key=token_end)
+        if position < len(tokens) and tokens[position][3] <= offset - start:
+            return index, position, self.absolute(index, position, position + 1)[0]
+        while not position and index:
+            index -= 1
+            start, _ = self.base(index)
+            position = len(self.segments[index].tokens)
+        if position and self.segments[index].tokens[position - 1][4] == offset - start:
+            return index, position - 1, self.absolute(index, position - 1, position)[0]
+        return None
+
+    def lookup(self, offset):
+        """
+        (token, Symbol or symbol_table.Function) for the identifier at
+        offset, looked up in the scope it appears in, or None. Nothing is
+        found while the program head does not parse.
+        """
+        self.settle()
+        found = self.token_at(offset)
+        if found is None or found[2][0] != 'IDENTIFIER' or self.segments[0].state != OK:
+            return None
+        index, position, token = found
+        tokens = self.segments[index].tokens
+        name = token[1]
+        following = tokens[position + 1][1] if position + 1 < len(tokens) else None
+        preceding = tokens[position - 1][1] if position else None
+        if following == '(' or preceding == 'function':
+            function = self.symbol_table.functions.get(name)
+            return (token, function) if function is not None and function.entry is not None else None
+        symbol = None
+        if index == 0:
+            scope = self.function_at(position)
+            if scope is not None:
+                symbol = next((symbol for symbol in dict(self.symbol_table.frames).get(scope, ())
+                               if symbol.name == name), None)
+        if symbol is None:
+            symbol = self.symbol_table.symbols.get(name)
+        return (token, symbol) if symbol is not None else None
+
+    def function_at(self, position):
+        # Name of the function whose definition holds the head's token at
+        # position, or None. Bodies cannot hold '#', so the definitions end
+        # at the head's first '#'.
+        candidates = [function for function in self.symbol_table.functions.values()
+                      if function.position is not None and function.position <= position]
+        if not candidates:
+            return None
+        function = max(candidates, key=attrgetter('position'))
+        for token in self.segments[0].tokens[function.position:position]:
+            if token[1] == '#':
+                return None
+        return function.name
+
+    def declaration(self, target):
+        # The token declaring a Symbol or Function of the current head
+        return self.absolute(0, target.position, target.position + 1)[0]
+
+    def listing_text(self):
+        # The .out listing a full compile writes
+        parser = Parser(())
+        parser.symbol_table = self.symbol_table
+        parser.instr_table = self.instr_table()
+        return parser.listing_text()
+
+
+def full_compile(source, fold_constants=False):
+    # (listing or None, error or None) from compiling source from scratch
+    parser = Parser(Lexer(source).lex(), fold_constants=fold_constants, source=source)
+    try:
+        parser.rat25f()
+    except Exception as e:
+        return None, str(e)
+    return parser.listing_text(), None
+
+
+def random_edit(rng, source):
+    # A small edit of the kind typing makes: insert or delete a few
+    # characters, or replace a token-sized run
+    offset = rng.randint(0, len(source))
+    action = rng.random()
+    if action < 0.4:
+        text = rng.choice(['a', '1', ' ', ';', '\n', '+', '(', ')', '{', '}', '"', '#', 'x = 1;', 'if', '.5'])
+        return offset, 0, text
+    deleted = min(rng.randint(1, 3), len(source) - offset)
+    if action < 0.8:
+        return offset, deleted, ''
+    return offset, deleted, rng.choice(['b', '2', '==', 'while', ' '])
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(
+        description="Replay random edits on a Rat25F file through an incremental Document, "
+                    "checking each result against a full compile and timing the edits.")
+    arg_parser.add_argument('filename')
+    arg_parser.add_argument('--edits', type=int, default=200)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--optimize', action='store_true', help="fold constants")
+    arg_parser.add_argument('--no-check', action='store_true',
+                            help="only time the edits, without full compiles to compare")
+    args = arg_parser.parse_args()
+
+    with open(args.filename) as f:
+        text = f.read()
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    document = Document(text, args.optimize)
+    print(f"Initial compile: {time.perf_counter() - start:.4f}s, {len(document.segments)} segments")
+
+    times = []
+    for count in range(args.edits):
+        edit = random_edit(rng, document.source)
+        start = time.perf_counter()
+        document.edit(*edit)
+        error = document.error
+        times.append(time.perf_counter() - start)
+        if args.no_check:
+            continue
+        listing, expected = full_compile(document.source, args.optimize)
+        got = document.listing_text() if error is None else None
+        if (got, error) != (listing, expected):
+            print(f"Mismatch after edit {count + 1} {edit!r}:\n{error or got}\nexpected:\n{expected or listing}")
+            sys.exit(1)
+    times.sort()
+    if times:
+        print(f"{len(times)} edits: median {times[len(times) // 2] * 1e3:.3f} ms, "
+              f"max {times[-1] * 1e3:.3f} ms")
@@ -0,0 +1,295 @@
+import mmap
+import struct
+import sys
+from array import array
+from collections import namedtuple
+
+# Opcodes in code order. The code of an op is its index in OPCODES.
+OPCODES = (
+    'PUSHI', 'PUSHM', 'POPM', 'STDIN', 'STDOUT',
+    'ADD', 'SUB', 'MUL', 'DIV',
+    'GRT', 'LES', 'EQU', 'NEQ', 'GEQ', 'LEQ',
+    'JUMPZ', 'JUMP', 'LABEL',
+    'PUSHL', 'POPL',
+    'CALL', 'ENTER', 'RET',
+    'PUSHR', 'PUSHMR', 'POPMR', 'PUSHLR', 'POPLR', 'STDINR', 'ITOR',
+    'ADDR', 'SUBR', 'MULR', 'DIVR',
+    'GRTR', 'LESR', 'EQUR', 'NEQR', 'GEQR', 'LEQR',
+)
+OPCODE_CODES = {op: code for code, op in enumerate(OPCODES)}
+
+# Ops that take an operand; all others list with an empty operand column.
+# PUSHL and POPL address a local by its offset from the frame pointer.
+# CALL takes the address of a function's ENTER, and ENTER its frame size.
+# The R ops are the real-typed counterparts of the integer ones; PUSHR
+# stores its double's IEEE 754 bits in the int64 operand.
+OPERAND_OPS = {'PUSHI', 'PUSHM', 'POPM', 'JUMPZ', 'JUMP', 'PUSHL', 'POPL', 'CALL', 'ENTER',
+               'PUSHR', 'PUSHMR', 'POPMR', 'PUSHLR', 'POPLR'}
+OPERAND_CODES = {OPCODE_CODES[op] for op in OPERAND_OPS}
+PUSHR_CODE = OPCODE_CODES['PUSHR']
+
+# Real-typed op for each integer arithmetic and comparison op. They accept
+# integer operands and always produce a real (comparisons a 0/1 integer).
+REAL_OPS = {
+    'ADD': 'ADDR', 'SUB': 'SUBR', 'MUL': 'MULR', 'DIV': 'DIVR',
+    'GRT': 'GRTR', 'LES': 'LESR', 'EQU': 'EQUR', 'NEQ': 'NEQR',
+    'GEQ': 'GEQR', 'LEQ': 'LEQR',
+}
+
+# Operands are stored as signed 64-bit integers
+OPERAND_MIN = -2 ** 63
+OPERAND_MAX = 2 ** 63 - 1
+
+
+def div_trunc(a, b):
+    # Integer division truncating toward zero, shared by the VM and the
+    # optimizers so folded and executed results agree
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+# Compile-time evaluation of binary ops on two constants
+FOLD_OPS = {
+    'ADD': lambda a, b: a + b,
+    'SUB': lambda a, b: a - b,
+    'MUL': lambda a, b: a * b,
+    'DIV': div_trunc,
+    'GRT': lambda a, b: 1 if a > b else 0,
+    'LES': lambda a, b: 1 if a < b else 0,
+    'EQU': lambda a, b: 1 if a == b else 0,
+    'NEQ': lambda a, b: 1 if a != b else 0,
+    'GEQ': lambda a, b: 1 if a >= b else 0,
+    'LEQ': lambda a, b: 1 if a <= b else 0,
+}
+
+
+REAL_BITS = struct.Struct('<d')
+OPRND_BITS = struct.Struct('<q')
+
+
+def real_to_oprnd(value):
+    # The int64 operand holding a double's bits
+    return OPRND_BITS.unpack(REAL_BITS.pack(value))[0]
+
+
+def oprnd_to_real(oprnd):
+    return REAL_BITS.unpack(OPRND_BITS.pack(oprnd))[0]
+
+
+def padded_size(size):
+    # Round up to a multiple of 8 so the operand array stays aligned
+    return (size + 7) & ~7
+
+
+def fold_binary(op, a, b):
+    # Returns None when the op must be left to run time: division by zero
+    # keeps its runtime error and results must fit an operand
+    if op == 'DIV' and b == 0:
+        return None
+    value = FOLD_OPS[op](a, b)
+    if not OPERAND_MIN <= value <= OPERAND_MAX:
+        return None
+    return value
+
+
+# Binary listing: a fixed header (magic, format version, reserved, count,
+# symbol table size), count opcode bytes zero-padded to a multiple of 8,
+# count little-endian int64 operands, then the symbol table section of the
+# listing as UTF-8 text. The header is a multiple of 8 bytes, so the operand
+# array is 8-byte aligned in the file and can be used in place.
+BINARY_MAGIC = b'R25B'
+BINARY_VERSION = 2
+BINARY_HEADER = struct.Struct('<4sHHQQ')
+
+
+def binary_sections(buffer):
+    # memoryviews of the opcode, operand and symbol table sections of a
+    # binary listing, without copying. The operands are native int64 on
+    # little-endian machines only.
+    view = memoryview(buffer)
+    if len(view) < BINARY_HEADER.size:
+        raise Exception("Not a binary instruction listing")
+    magic, version, _, count, symbols_size = BINARY_HEADER.unpack_from(view)
+    if magic != BINARY_MAGIC:
+        raise Exception("Not a binary instruction listing")
+    if version != BINARY_VERSION:
+        raise Exception(f"Binary listing version {version}, expected {BINARY_VERSION}")
+    ops_start = BINARY_HEADER.size
+    oprnds_start = ops_start + padded_size(count)
+    symbols_start = oprnds_start + 8 * count
+    if len(view) != symbols_start + symbols_size:
+        raise Exception("Truncated binary instruction listing")
+    return (view[ops_start:ops_start + count], view[oprnds_start:symbols_start],
+            view[symbols_start:])
+
+
+def listing_text(instr_table, symbols):
+    # The whole .out listing of an instruction table and its symbol table
+    # section text, built with one join
+    lines = ["Assembly Code Listing"]
+    lines.extend(instr_table.listing_lines())
+    lines.append("")
+    lines.append(symbols)
+    return "\n".join(lines) + "\n"
+
+
+def listing_symbols(text):
+    # The symbol table section of a .out file's text
+    start = text.find("\nSymbol Table\n")
+    if start < 0:
+        raise Exception("No symbol table in listing")
+    return text[start + 1:].rstrip("\n")
+
+
+# Read-only view of one instruction, as yielded by InstrTable
+Instr = namedtuple('Instr', ['address', 'op', 'oprnd'])
+
+
+class InstrTable:
+    """
+    Instruction table stored as two parallel arrays: opcode codes in an
+    array('B') and operands in an array('q'). Addresses are 1-based and
+    implicit in the position. Ops without an operand store 0 and read back
+    as None; PUSHR operands are stored as bits (see real_to_oprnd) and read
+    back as floats. A table made by from_buffer holds read-only memoryviews
+    instead of arrays.
+    """
+    __slots__ = ('ops', 'oprnds')
+
+    def __init__(self):
+        self.ops = array('B')
+        self.oprnds = array('q')
+
+    @classmethod
+    def from_codes(cls, ops, oprnds):
+        # Build a table from opcode codes and operands, e.g. after a pass
+        table = cls()
+        table.ops = array('B', ops)
+        table.oprnds = array('q', oprnds)
+        return table
+
+    @classmethod
+    def from_listing(cls, text):
+        # Parse the "Assembly Code Listing" section of a .out file's text
+        lines = text.splitlines()
+        if not lines or lines[0] != "Assembly Code Listing":
+            raise Exception(f"No assembly listing: {' '.join(lines)}")
+        table = cls()
+        for line_number, line in enumerate(lines[1:], start=2):
+            if not line.strip():
+                continue
+            if line == "Symbol Table":
+                break
+            fields = line.split()
+            if len(fields) not in (2, 3) or fields[1] not in OPCODE_CODES:
+                raise Exception(f"Bad listing line {line_number}: {line}")
+            if int(fields[0]) != len(table) + 1:
+                raise Exception(f"Bad listing line {line_number}: address out of sequence")
+            if len(fields) == 2:
+                oprnd = None
+            elif fields[1] == 'PUSHR':
+                oprnd = real_to_oprnd(float(fields[2]))
+            else:
+                oprnd = int(fields[2])
+            table.append(fields[1], oprnd)
+        return table
+
+    @classmethod
+    def from_bytes(cls, data):
+        # Inverse of to_bytes; the symbol table section is skipped
+        ops, oprnds, _ = binary_sections(data)
+        table = cls()
+        table.ops.frombytes(ops)
+        table.oprnds.frombytes(oprnds)
+        if sys.byteorder != 'little':
+            table.oprnds.byteswap()
+        return table
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        # A read-only table over a binary listing's sections in buffer, e.g.
+        # an mmap, without copying: the arrays are memoryviews into it.
+        # Returns (table, symbol table section as a memoryview).
+        ops, oprnds, symbols = binary_sections(buffer)
+        table = cls()
+        table.ops = ops
+        if sys.byteorder == 'little':
+            table.oprnds = oprnds.cast('q')
+        else:
+            table.oprnds = array('q')
+            table.oprnds.frombytes(oprnds)
+            table.oprnds.byteswap()
+        return table, symbols
+
+    def to_bytes(self, symbols=""):
+        # symbols is the listing's symbol table section (see
+        # Parser.symbol_table_text), stored after the operands
+        count = len(self.ops)
+        oprnds = self.oprnds
+        if sys.byteorder != 'little':
+            oprnds = array('q', oprnds)
+            oprnds.byteswap()
+        padding = bytes(padded_size(count) - count)
+        symbols = symbols.encode('utf-8')
+        return b''.join((BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, count, len(symbols)),
+                         self.ops.tobytes(), padding, oprnds.tobytes(), symbols))
+
+    def append(self, op, oprnd):
+        self.ops.append(OPCODE_CODES[op])
+        self.oprnds.append(0 if oprnd is None else oprnd)
+        return len(self.ops)
+
+    def truncate(self, length):
+        # Drop every instruction after the first length
+        del self.ops[length:]
+        del self.oprnds[length:]
+
+    def set_oprnd(self, address, oprnd):
+        self.oprnds[address - 1] = oprnd
+
+    def __len__(self):
+        return len(self.ops)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.ops)
+        code = self.ops[index]
+        oprnd = self.oprnds[index] if code in OPERAND_CODES else None
+        if code == PUSHR_CODE:
+            oprnd = oprnd_to_real(oprnd)
+        return Instr(index + 1, OPCODES[code], oprnd)
+
+    def __iter__(self):
+        for index in range(len(self.ops)):
+            yield self[index]
+
+    def listing_lines(self):
+        # One "address op operand" line per instruction, as in the .out
+        # files, read straight from the arrays without building an Instr
+        names = [f"{op:<6} " for op in OPCODES]
+        for address, (code, oprnd) in enumerate(zip(self.ops, self.oprnds), 1):
+            if code not in OPERAND_CODES:
+                oprnd = ""
+            elif code == PUSHR_CODE:
+                oprnd = oprnd_to_real(oprnd)
+            yield f"{address:<4} {names[code]}{oprnd}"
+
+
+class MappedListing:
+    """
+    A binary listing file mapped into memory. table is a read-only
+    InstrTable whose arrays are memoryviews into the mapping, so loading
+    reads only the header and builds nothing per instruction; pages are
+    read in as the table is used. The mapping lasts as long as the views.
+    """
+    __slots__ = ('table', 'symbols')
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if not f.seek(0, 2):
+                raise Exception("Not a binary instruction listing")
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.table, self.symbols = InstrTable.from_buffer(mapping)
+
+    def listing_text(self):
+        return listing_text(self.table, str(self.symbols, 'utf-8'))
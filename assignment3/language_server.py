@@ -0,0 +1,401 @@
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from incremental import Document
+from symbol_table import Function, TYPE_NAMES, UNKNOWN
+
+# JSON-RPC and LSP error codes
+PARSE_ERROR = -32700
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+REQUEST_CANCELLED = -32800
+CONTENT_MODIFIED = -32801
+
+# Requests whose answer depends on the document's current text
+DOCUMENT_REQUESTS = ('textDocument/hover', 'textDocument/definition')
+
+
+def read_message(stream):
+    # One message in LSP base protocol framing (Content-Length headers, a
+    # blank line, then the JSON body), or None at the end of the stream.
+    # Raises ValueError for a malformed header or body.
+    length = None
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            break
+        name, _, value = line.decode('ascii', 'replace').partition(':')
+        if name.lower() == 'content-length':
+            # Checked after the blank line, so a bad header skips its
+            # whole header block
+            length = value.strip()
+    if length is None or not length.isdigit():
+        raise ValueError("Message without a valid Content-Length")
+    message = json.loads(stream.read(int(length)).decode('utf-8'))
+    if not isinstance(message, dict):
+        raise ValueError("Message is not a JSON object")
+    return message
+
+
+def utf16_length(text):
+    # Length of text in UTF-16 code units, LSP's default position unit
+    if text.isascii():
+        return len(text)
+    return len(text) + sum(1 for c in text if ord(c) > 0xFFFF)
+
+
+def utf16_index(text, units):
+    # Index in text of the code point units UTF-16 code units in, clamped
+    # to the end of text
+    if text.isascii():
+        return min(units, len(text))
+    for index, c in enumerate(text):
+        units -= 2 if ord(c) > 0xFFFF else 1
+        if units < 0:
+            return index
+    return len(text)
+
+
+def document_uri(message):
+    # params.textDocument.uri of a message, or None when it has none
+    params = message.get('params')
+    document = params.get('textDocument') if isinstance(params, dict) else None
+    return document.get('uri') if isinstance(document, dict) else None
+
+
+def write_message(stream, message):
+    body = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    stream.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+    stream.flush()
+
+
+class OpenDocument:
+    """
+    An open editor buffer: its incremental.Document and the version the
+    client last sent. LSP positions are (0-based line, character), with
+    characters counted in UTF-16 code units. anchor is a (line, offset of its
+    first character) pair known to be right for the current text; edits
+    come close together, so positions are found by walking lines from it.
+    """
+    __slots__ = ('uri', 'version', 'document', 'anchor')
+
+    def __init__(self, uri, version, text):
+        self.uri = uri
+        self.version = version
+        self.document = Document(text)
+        self.anchor = (0, 0)
+
+    def offset(self, position):
+        source = self.document.source
+        line, start = self.anchor
+        while line < position['line']:
+            start = source.find('\n', start) + 1
+            if not start:
+                return len(source)
+            line += 1
+        while line > position['line']:
+            start = source.rfind('\n', 0, start - 1) + 1
+            line -= 1
+        self.anchor = (line, start)
+        end = source.find('\n', start)
+        if end < 0:
+            end = len(source)
+        return start + utf16_index(source[start:end], position['character'])
+
+    def position(self, offset, line=None):
+        # line is the 1-based line of offset when the caller knows it
+        source = self.document.source
+        if line is None:
+            line = source.count('\n', 0, offset) + 1
+        start = source.rfind('\n', 0, offset) + 1
+        return {'line': line - 1, 'character': utf16_length(source[start:offset])}
+
+    def token_range(self, token):
+        start = self.position(token[3], token[2])
+        length = utf16_length(self.document.source[token[3]:token[4]])
+        return {'start': start,
+                'end': {'line': start['line'], 'character': start['character'] + length}}
+
+    def apply(self, change):
+        # One entry of didChange's contentChanges: a range and its new
+        # text, or the whole text without a range
+        document = self.document
+        if 'range' not in change:
+            document.edit(0, len(document.source), change['text'])
+            self.anchor = (0, 0)
+            return
+        start = self.offset(change['range']['start'])
+        anchor = self.anchor
+        end = self.offset(change['range']['end'])
+        # The start line's offset is before the edit, so it stays right
+        self.anchor = anchor
+        document.edit(start, end - start, change['text'])
+
+
+class LanguageServer:
+    """
+    A Language Server Protocol server over a pair of byte streams, normally
+    stdin and stdout. It stays running across requests, so the compiler is
+    imported once and each open document is kept lexed and parsed in an
+    incremental.Document between edits.
+
+    Diagnostics are debounced: they are published once debounce seconds
+    pass without a change to the document, so typing does not queue a
+    parse per keystroke. Messages waiting to be read are handled together:
+    a request cancelled by $/cancelRequest is answered RequestCancelled and
+    a hover or definition request followed by a change to its document is
+    answered ContentModified, without doing the work.
+    """
+
+    def __init__(self, reader, writer, debounce=0.2):
+        self.writer = writer
+        self.debounce = debounce
+        self.documents = {}
+        # Diagnostics still to publish, as {uri: time they are due}
+        self.due = {}
+        self.shutdown_requested = False
+        self.handlers = {
+            'initialize': self.initialize,
+            'initialized': lambda params: None,
+            'shutdown': self.shutdown,
+            'textDocument/didOpen': self.did_open,
+            'textDocument/didChange': self.did_change,
+            'textDocument/didClose': self.did_close,
+            'textDocument/hover': self.hover,
+            'textDocument/definition': self.definition,
+            '$/cancelRequest': lambda params: None,
+        }
+        # A reader thread queues messages as they arrive, so the ones
+        # waiting can be looked at before any is handled
+        self.messages = queue.Queue()
+        threading.Thread(target=self.read_loop, args=(reader,), daemon=True).start()
+
+    def read_loop(self, reader):
+        # A message that cannot be parsed is queued as its ValueError and
+        # reading goes on. The None queued last, at the end of input or on
+        # a read error, stops the main loop.
+        try:
+            while True:
+                try:
+                    message = read_message(reader)
+                except ValueError as e:
+                    message = e
+                if message is None:
+                    return
+                self.messages.put(message)
+        finally:
+            self.messages.put(None)
+
+    def serve(self):
+        # Handles messages until exit or the end of input; returns the
+        # process exit code
+        while True:
+            timeout = None
+            if self.due:
+                timeout = max(0.0, min(self.due.values()) - time.monotonic())
+            try:
+                message = self.messages.get(timeout=timeout)
+            except queue.Empty:
+                self.publish_due()
+                continue
+            batch = [message]
+            while True:
+                try:
+                    batch.append(self.messages.get_nowait())
+                except queue.Empty:
+                    break
+            code = self.handle_batch(batch)
+            if code is not None:
+                return code
+            self.publish_due()
+
+    def handle_batch(self, batch):
+        # Fields are read defensively here: a malformed message is only
+        # answered once dispatched
+        cancelled = set()
+        for message in batch:
+            if isinstance(message, dict) and message.get('method') == '$/cancelRequest':
+                params = message.get('params')
+                if isinstance(params, dict) and isinstance(params.get('id'), (int, str)):
+                    cancelled.add(params['id'])
+        # Requests answered by a later change in the same batch
+        stale = set()
+        changed = set()
+        for position in reversed(range(len(batch))):
+            message = batch[position]
+            if not isinstance(message, dict):
+                continue
+            method = message.get('method')
+            uri = document_uri(message)
+            if uri is None:
+                continue
+            if method == 'textDocument/didChange':
+                changed.add(uri)
+            elif method in DOCUMENT_REQUESTS and uri in changed:
+                stale.add(position)
+
+        for position, message in enumerate(batch):
+            if message is None:
+                return 0 if self.shutdown_requested else 1
+            if isinstance(message, ValueError):
+                # The request's id is unknown, so the error goes with a null id
+                self.respond_error(None, PARSE_ERROR, f"Parse error: {message}")
+                continue
+            if message.get('method') == 'exit':
+                return 0 if self.shutdown_requested else 1
+            if 'id' in message and 'method' in message:
+                if isinstance(message['id'], (int, str)) and message['id'] in cancelled:
+                    self.respond_error(message['id'], REQUEST_CANCELLED, "Request cancelled")
+                    continue
+                if position in stale:
+                    self.respond_error(message['id'], CONTENT_MODIFIED, "Document changed")
+                    continue
+            self.dispatch(message)
+        return None
+
+    def dispatch(self, message):
+        method = message.get('method')
+        if method is None:
+            # A response to a request of ours; none are sent
+            return
+        handler = self.handlers.get(method)
+        request = 'id' in message
+        if handler is None:
+            if request:
+                self.respond_error(message['id'], METHOD_NOT_FOUND, f"Unknown method '{method}'")
+            return
+        try:
+            result = handler(message.get('params'))
+        except Exception as e:
+            if request:
+                self.respond_error(message['id'], INTERNAL_ERROR, str(e))
+            else:
+                self.notify('window/logMessage', {'type': 1, 'message': f"{method}: {e}"})
+            return
+        if request:
+            self.send({'jsonrpc': '2.0', 'id': message['id'], 'result': result})
+
+    def send(self, message):
+        write_message(self.writer, message)
+
+    def notify(self, method, params):
+        self.send({'jsonrpc': '2.0', 'method': method, 'params': params})
+
+    def respond_error(self, id_, code, text):
+        self.send({'jsonrpc': '2.0', 'id': id_, 'error': {'code': code, 'message': text}})
+
+    # --- Lifecycle ---
+
+    def initialize(self, params):
+        return {
+            'capabilities': {
+                # Incremental text changes
+                # Positions are counted in UTF-16 code units, the protocol default
+                'positionEncoding': 'utf-16',
+                'textDocumentSync': {'openClose': True, 'change': 2},
+                'hoverProvider': True,
+                'definitionProvider': True,
+            },
+            'serverInfo': {'name': 'rat25f'},
+        }
+
+    def shutdown(self, params):
+        self.shutdown_requested = True
+        return None
+
+    # --- Documents ---
+
+    def did_open(self, params):
+        item = params['textDocument']
+        self.documents[item['uri']] = OpenDocument(item['uri'], item.get('version'), item['text'])
+        self.schedule(item['uri'])
+
+    def did_change(self, params):
+        open_document = self.documents[params['textDocument']['uri']]
+        for change in params['contentChanges']:
+            open_document.apply(change)
+        open_document.version = params['textDocument'].get('version')
+        self.schedule(open_document.uri)
+
+    def did_close(self, params):
+        uri = params['textDocument']['uri']
+        self.documents.pop(uri, None)
+        self.due.pop(uri, None)
+        self.notify('textDocument/publishDiagnostics', {'uri': uri, 'diagnostics': []})
+
+    def schedule(self, uri):
+        self.due[uri] = time.monotonic() + self.debounce
+
+    def publish_due(self):
+        now = time.monotonic()
+        for uri, due in list(self.due.items()):
+            if due <= now:
+                del self.due[uri]
+                self.publish(self.documents[uri])
+
+    def publish(self, open_document):
+        diagnostics = []
+        found = open_document.document.diagnostic()
+        if found is not None:
+            message, token = found
+            if token is None:
+                end = open_document.position(len(open_document.document.source))
+                where = {'start': end, 'end': end}
+            else:
+                where = open_document.token_range(token)
+            diagnostics.append({'range': where, 'severity': 1, 'source': 'rat25f', 'message': message})
+        self.notify('textDocument/publishDiagnostics',
+                    {'uri': open_document.uri, 'version': open_document.version,
+                     'diagnostics': diagnostics})
+
+    # --- Requests ---
+
+    def find(self, params):
+        # (OpenDocument, token, Symbol or Function) at a request's position
+        open_document = self.documents[params['textDocument']['uri']]
+        found = open_document.document.lookup(open_document.offset(params['position']))
+        if found is None:
+            return open_document, None, None
+        return (open_document,) + found
+
+    def hover(self, params):
+        open_document, token, target = self.find(params)
+        if target is None:
+            return None
+        if isinstance(target, Function):
+            params_text = ', '.join(TYPE_NAMES[type_] for type_ in target.param_types)
+            return_type = TYPE_NAMES[target.type if target.type is not None else UNKNOWN]
+            text = f"function {target.name}({params_text}) {return_type}\nentry address {target.entry}"
+        elif target.local:
+            text = f"{target.type} {target.name}\nlocal, frame offset {target.address}"
+        else:
+            text = f"{target.type} {target.name}\nmemory address {target.address}"
+        return {'contents': {'kind': 'plaintext', 'value': text},
+                'range': open_document.token_range(token)}
+
+    def definition(self, params):
+        open_document, token, target = self.find(params)
+        if target is None:
+            return None
+        return {'uri': open_document.uri,
+                'range': open_document.token_range(open_document.document.declaration(target))}
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(
+        description="Rat25F language server: speaks the Language Server Protocol on stdin and stdout.")
+    arg_parser.add_argument('--debounce', type=float, default=0.2,
+                            help="seconds without changes before a document's diagnostics are published")
+    args = arg_parser.parse_args()
+    code = LanguageServer(sys.stdin.buffer, sys.stdout.buffer, args.debounce).serve()
+    # The reader thread may be blocked reading stdin, which a normal exit
+    # would wait on at shutdown
+    sys.stdout.flush()
+    os._exit(code)
@@ -1,3 +1,7 @@
+import re
+from array import array
+from bisect import bisect_right
+
 # Token types
 TOKEN_TYPES = {
     'KEYWORD': 'KEYWORD',
@@ -23,46 +27,330 @@ OPERATOR_STARTS = {'=', '!', '<', '>', '+', '-', '*', '/'}
 # Separators
 SEPARATORS = {'#', '(', ')', '{', '}', ',', ';'}
 
+# Scanner modes: 'regex' runs one precompiled master pattern over the whole
+# source, 'fsm' is the original character-at-a-time driver
+SCANNER_MODES = ('regex', 'fsm')
+
+# Default number of characters read per chunk by Lexer.iterTokens
+CHUNK_SIZE = 64 * 1024
+
+# Master pattern for the regex scanner. Each match is optional whitespace
+# followed by one token, and alternatives are tried in order, so the number
+# rules mirror handleNumber exactly: '.5.5' is a REAL, '12.' and '.5.' are
+# UNKNOWN and a bare '.' is UNKNOWN. Comments are matched like tokens and then
+# dropped, END absorbs trailing whitespace, and any other character becomes a
+# one-character UNKNOWN. The classes are ASCII only; non-ASCII sources go
+# through the FSM (see lex).
+WHITESPACE_CLASS = r'\t\n\x0b\x0c\r\x1c-\x1f '
+MASTER_PATTERN = re.compile(r'''
+    [%(ws)s]*
+    (?:
+        (?P<WORD>[A-Za-z][A-Za-z0-9_$]*)
+      | (?P<INTEGER>[0-9]+(?![0-9.]))
+      | (?P<OPERATOR>==|!=|<=|=>|[=><+\-*/])
+      | (?P<SEPARATOR>[\#(){},;])
+      | (?P<COMMENT>"[^"]*"?)
+      | (?P<REAL>\.[0-9]+\.[0-9]+|[0-9]+\.[0-9]+|\.[0-9]+(?![0-9.]))
+      | (?P<BADNUMBER>\.[0-9]+\.|[0-9]+\.|\.)
+      | (?P<END>\Z)
+      | (?P<UNKNOWN>[^"%(ws)s])
+    )
+''' % {'ws': WHITESPACE_CLASS}, re.VERBOSE)
+
+# Token type for each master pattern group, indexed by match.lastindex. WORD is
+# resolved against KEYWORDS, and None marks matches that produce no token.
+WORD_GROUP = MASTER_PATTERN.groupindex['WORD']
+GROUP_TOKEN_TYPES = [None] * (MASTER_PATTERN.groups + 1)
+for groupName, groupIndex in MASTER_PATTERN.groupindex.items():
+    if groupName == 'BADNUMBER':
+        GROUP_TOKEN_TYPES[groupIndex] = TOKEN_TYPES['UNKNOWN']
+    elif groupName not in ('WORD', 'COMMENT', 'END'):
+        GROUP_TOKEN_TYPES[groupIndex] = TOKEN_TYPES[groupName]
+
+# Tokens are (type, lexeme, line, start, end) tuples, where start and end are
+# offsets into the source: source[start:end] == lexeme. Columns are not
+# stored; LineIndex derives them from start when a diagnostic needs one.
+
+# Offsets of the start of every line, built in one pass over the source the
+# first time a line number is looked up, so the line and column of any
+# offset is a binary search away. Lexing itself never looks at columns, and
+# a caret only needs the text around its offset.
+class LineIndex:
+    __slots__ = ('source', 'starts')
+
+    def __init__(self, source):
+        self.source = source
+        self.starts = None
+
+    @property
+    def lineStarts(self):
+        if self.starts is None:
+            self.starts = array('Q', [0])
+            self.starts.extend(match.end() for match in re.finditer('\n', self.source))
+        return self.starts
+
+    # 1-based (line, column) of a source offset
+    def lineCol(self, offset):
+        lineStarts = self.lineStarts
+        line = bisect_right(lineStarts, offset)
+        return line, offset - lineStarts[line - 1] + 1
+
+    # Text of a 1-based line, without its newline
+    def lineText(self, line):
+        return self.textFrom(self.lineStarts[line - 1])
+
+    def textFrom(self, start):
+        end = self.source.find('\n', start)
+        return self.source[start:end if end >= 0 else len(self.source)].rstrip('\r')
+
+    # The source line holding offset with a caret under start:end, e.g.
+    #     a = 10;
+    #     ^
+    def caret(self, start, end):
+        lineStart = self.source.rfind('\n', 0, start) + 1
+        column = start - lineStart + 1
+        text = self.textFrom(lineStart)
+        # Keep tabs so the caret lines up however the tabs are shown
+        pad = ''.join(c if c == '\t' else ' ' for c in text[:column - 1])
+        width = max(1, min(end, start + len(text) - column + 1) - start)
+        return f"{text}\n{pad}{'^' * width}"
+
 class Lexer:
-    def __init__(self, sourceCode):
+    def __init__(self, sourceCode, mode='regex'):
+        if mode not in SCANNER_MODES:
+            raise ValueError(f"Unknown scanner mode '{mode}'")
         self.sourceCode = sourceCode
+        self.mode = mode
         self.tokens = []
         self.currentPosition = 0
         self.lineNumber = 1
+        # Offset up to which newlines are counted into lineNumber
+        self.linePosition = 0
+        self.index = None
 
     def lex(self):
+        # The master pattern only knows ASCII character classes, so anything
+        # else keeps the FSM and its str.isalpha/isdigit/isspace semantics
+        if self.mode == 'regex' and self.sourceCode.isascii():
+            return self.lexRegex()
+        return self.lexFSM()
+
+    # The LineIndex of the source, built on first use
+    def lineIndex(self):
+        if self.index is None:
+            self.index = LineIndex(self.sourceCode)
+        return self.index
+
+    # Regex driver: one match per token or comment. Line numbers are counted
+    # between tokens with str.count instead of inspecting every character.
+    def lexRegex(self):
+        source = self.sourceCode
+        count = source.count
+        append = self.tokens.append
+        keywordType = TOKEN_TYPES['KEYWORD']
+        identifierType = TOKEN_TYPES['IDENTIFIER']
+        lineNumber = self.lineNumber
+        lastPosition = self.currentPosition
+
+        for match in MASTER_PATTERN.finditer(source, self.currentPosition):
+            group = match.lastindex
+            if group == WORD_GROUP:
+                tokenType = None
+            else:
+                tokenType = GROUP_TOKEN_TYPES[group]
+                if tokenType is None:
+                    continue
+            # Tokens never contain a newline, so counting up to the end of the
+            # match gives the line the token starts on
+            end = match.end()
+            lineNumber += count('\n', lastPosition, end)
+            lastPosition = end
+            lexeme = match[group]
+            if tokenType is None:
+                tokenType = keywordType if lexeme in KEYWORDS else identifierType
+            append((tokenType, lexeme, lineNumber, end - len(lexeme), end))
+
+        self.lineNumber = lineNumber + source.count('\n', lastPosition)
+        self.currentPosition = self.linePosition = len(source)
+        return self.tokens
+
+    # Generator over the tokens from position to the end of the source, for
+    # a scan resumed at a token boundary (see incremental.Document).
+    # lineNumber is the line at position. The regex scanner is only right
+    # for ASCII sources, so callers choose the mode as lex() would.
+    def scanFrom(self, position, lineNumber):
+        source = self.sourceCode
+        if self.mode == 'fsm':
+            self.currentPosition = self.linePosition = position
+            self.lineNumber = lineNumber
+            tokens = self.tokens
+            while self.currentPosition < len(source):
+                self.lexStep()
+                if tokens:
+                    yield tokens.pop()
+            return
+
+        count = source.count
+        keywordType = TOKEN_TYPES['KEYWORD']
+        identifierType = TOKEN_TYPES['IDENTIFIER']
+        lastPosition = position
+        for match in MASTER_PATTERN.finditer(source, position):
+            group = match.lastindex
+            if group == WORD_GROUP:
+                tokenType = None
+            else:
+                tokenType = GROUP_TOKEN_TYPES[group]
+                if tokenType is None:
+                    continue
+            end = match.end()
+            lineNumber += count('\n', lastPosition, end)
+            lastPosition = end
+            lexeme = match[group]
+            if tokenType is None:
+                tokenType = keywordType if lexeme in KEYWORDS else identifierType
+            yield (tokenType, lexeme, lineNumber, end - len(lexeme), end)
+
+    def lexFSM(self):
         # Main FSM driver
         # Continue until all characters in the source code have been processed
         while self.currentPosition < len(self.sourceCode):
-            char = self.sourceCode[self.currentPosition]
+            self.lexStep()
+        self.countLines(self.currentPosition)
+        return self.tokens
 
-            if char.isspace():
-                if char == '\n':
-                    self.lineNumber += 1
-                self.currentPosition += 1
-                continue
+    # Brings lineNumber up to the given offset. Newlines are counted with
+    # str.count from one token to the next, not character by character.
+    def countLines(self, position):
+        self.lineNumber += self.sourceCode.count('\n', self.linePosition, position)
+        self.linePosition = position
 
-            if char == '"':
-                self.handleComments()
-                continue
+    # Appends the token source[start:end]
+    def addToken(self, tokenType, start, end):
+        source = self.sourceCode
+        self.lineNumber += source.count('\n', self.linePosition, start)
+        self.linePosition = start
+        self.tokens.append((tokenType, source[start:end], self.lineNumber, start, end))
 
-            if char.isalpha():
-                self.handleIdentifier()
-                continue
+    # One FSM step: consumes a run of whitespace, a comment or one token
+    # starting at currentPosition
+    def lexStep(self):
+        source = self.sourceCode
+        char = source[self.currentPosition]
 
-            if char.isdigit() or char == '.':
-                self.handleNumber()
-                continue
+        if char.isspace():
+            position = self.currentPosition + 1
+            end = len(source)
+            while position < end and source[position].isspace():
+                position += 1
+            self.currentPosition = position
+            return
+
+        if char == '"':
+            self.handleComments()
+            return
+
+        if char.isalpha():
+            self.handleIdentifier()
+            return
+
+        if char.isdigit() or char == '.':
+            self.handleNumber()
+            return
+
+        if char in OPERATOR_STARTS or char in SEPARATORS:
+            self.handleOperatorOrSeparator()
+            return
+
+        # If no token is recognized, we have an unknown token
+        self.addToken(TOKEN_TYPES['UNKNOWN'], self.currentPosition, self.currentPosition + 1)
+        self.currentPosition += 1
 
-            if char in OPERATOR_STARTS or char in SEPARATORS:
-                self.handleOperatorOrSeparator()
+    # Streaming driver: reads the stream in chunks of chunkSize characters and
+    # yields tokens as soon as they are complete. A match that runs into the end
+    # of the buffer may still grow, so it is carried over to the next chunk. An
+    # unfinished comment is carried as just its opening quote, which keeps the
+    # buffer bounded by the chunk size plus the longest token. Token offsets
+    # are from the start of the stream.
+    @classmethod
+    def iterTokens(cls, stream, chunkSize=CHUNK_SIZE, mode='regex'):
+        if mode not in SCANNER_MODES:
+            raise ValueError(f"Unknown scanner mode '{mode}'")
+        keywordType = TOKEN_TYPES['KEYWORD']
+        identifierType = TOKEN_TYPES['IDENTIFIER']
+        carry = ''
+        lineNumber = 1
+        # Stream offset of the end of the previous chunk
+        streamEnd = 0
+        atEnd = False
+
+        while not atEnd:
+            chunk = stream.read(chunkSize)
+            atEnd = not chunk
+            buffer = carry + chunk
+            # Stream offset of buffer[0]. A carried comment quote stands in
+            # for the real one, which is somewhere earlier.
+            base = streamEnd - len(carry)
+            streamEnd += len(chunk)
+            carry = ''
+            bufferEnd = len(buffer)
+
+            if mode == 'regex' and buffer.isascii():
+                lastPosition = 0
+                for match in MASTER_PATTERN.finditer(buffer):
+                    group = match.lastindex
+                    end = match.end()
+                    if end == bufferEnd and not atEnd:
+                        start = match.start(group)
+                        if buffer.startswith('"', start):
+                            lineNumber += buffer.count('\n', lastPosition)
+                            carry = cls.commentCarry(buffer, start)
+                        else:
+                            lineNumber += buffer.count('\n', lastPosition, start)
+                            carry = buffer[start:]
+                        break
+                    if group == WORD_GROUP:
+                        tokenType = None
+                    else:
+                        tokenType = GROUP_TOKEN_TYPES[group]
+                        if tokenType is None:
+                            continue
+                    lineNumber += buffer.count('\n', lastPosition, end)
+                    lastPosition = end
+                    lexeme = match[group]
+                    if tokenType is None:
+                        tokenType = keywordType if lexeme in KEYWORDS else identifierType
+                    yield (tokenType, lexeme, lineNumber, base + end - len(lexeme), base + end)
+                else:
+                    lineNumber += buffer.count('\n', lastPosition)
                 continue
-            
-            # If no token is recognized, we have an unknown token
-            self.tokens.append((TOKEN_TYPES['UNKNOWN'], char, self.lineNumber))
-            self.currentPosition += 1
 
-        return self.tokens
+            # Non-ASCII buffers step the FSM one token at a time so the carry
+            # point is known
+            lex = cls(buffer, 'fsm')
+            lex.lineNumber = lineNumber
+            while lex.currentPosition < bufferEnd:
+                start = lex.currentPosition
+                lex.lexStep()
+                if lex.currentPosition == bufferEnd and not atEnd:
+                    lex.tokens.clear()
+                    if buffer[start] == '"':
+                        carry = cls.commentCarry(buffer, start)
+                    else:
+                        carry = buffer[start:]
+                    break
+                if lex.tokens:
+                    tokenType, lexeme, tokenLine, tokenStart, tokenEnd = lex.tokens.pop()
+                    yield (tokenType, lexeme, tokenLine, base + tokenStart, base + tokenEnd)
+            lex.countLines(start if carry and carry != '"' else bufferEnd)
+            lineNumber = lex.lineNumber
+
+    # What to carry for a comment that runs to the end of the buffer: nothing if
+    # it is already closed, otherwise just the opening quote
+    @staticmethod
+    def commentCarry(buffer, start):
+        if len(buffer) - start > 1 and buffer.endswith('"'):
+            return ''
+        return '"'
 
     # FSM for handling comments
     def handleComments(self):
@@ -70,8 +358,6 @@ class Lexer:
         self.currentPosition += 1
         # Continue until the end of the comment is reached or the end of the source code is reached
         while self.currentPosition < len(self.sourceCode) and self.sourceCode[self.currentPosition] != '"':
-            if self.sourceCode[self.currentPosition] == '\n':
-                self.lineNumber += 1
             self.currentPosition += 1
         if self.currentPosition < len(self.sourceCode) and self.sourceCode[self.currentPosition] == '"':
             self.currentPosition += 1
@@ -86,9 +372,9 @@ class Lexer:
             self.currentPosition += 1
         lexeme = self.sourceCode[startPosition:self.currentPosition]
         if lexeme in KEYWORDS:
-            self.tokens.append((TOKEN_TYPES['KEYWORD'], lexeme, self.lineNumber))
+            self.addToken(TOKEN_TYPES['KEYWORD'], startPosition, self.currentPosition)
         else:
-            self.tokens.append((TOKEN_TYPES['IDENTIFIER'], lexeme, self.lineNumber))
+            self.addToken(TOKEN_TYPES['IDENTIFIER'], startPosition, self.currentPosition)
 
     # FSM for handling integers and real numbers
     def handleNumber(self):
@@ -100,7 +386,7 @@ class Lexer:
             isReal = True
             self.currentPosition += 1
             if self.currentPosition >= len(self.sourceCode) or not self.sourceCode[self.currentPosition].isdigit():
-                self.tokens.append((TOKEN_TYPES['UNKNOWN'], '.', self.lineNumber))
+                self.addToken(TOKEN_TYPES['UNKNOWN'], startPosition, self.currentPosition)
                 return
         
         # Continue until the end of the number is reached
@@ -112,17 +398,15 @@ class Lexer:
             self.currentPosition += 1
             # Check if there are digits after the decimal point
             if self.currentPosition >= len(self.sourceCode) or not self.sourceCode[self.currentPosition].isdigit():
-                lexeme = self.sourceCode[startPosition:self.currentPosition]
-                self.tokens.append((TOKEN_TYPES['UNKNOWN'], lexeme, self.lineNumber))
+                self.addToken(TOKEN_TYPES['UNKNOWN'], startPosition, self.currentPosition)
                 return
             while self.currentPosition < len(self.sourceCode) and self.sourceCode[self.currentPosition].isdigit():
                 self.currentPosition += 1
 
-        lexeme = self.sourceCode[startPosition:self.currentPosition]
         if isReal:
-            self.tokens.append((TOKEN_TYPES['REAL'], lexeme, self.lineNumber))
+            self.addToken(TOKEN_TYPES['REAL'], startPosition, self.currentPosition)
         else:
-            self.tokens.append((TOKEN_TYPES['INTEGER'], lexeme, self.lineNumber))
+            self.addToken(TOKEN_TYPES['INTEGER'], startPosition, self.currentPosition)
 
     # FSM for handling operators and separators
     def handleOperatorOrSeparator(self):
@@ -133,19 +417,17 @@ class Lexer:
         if self.currentPosition + 1 < len(self.sourceCode):
             twoCharOp = op + self.sourceCode[self.currentPosition + 1]
             if twoCharOp in OPERATORS:
-                self.tokens.append((TOKEN_TYPES['OPERATOR'], twoCharOp, self.lineNumber))
+                self.addToken(TOKEN_TYPES['OPERATOR'], startPosition, startPosition + 2)
                 self.currentPosition += 2
                 return
 
         if op in OPERATORS:
-            self.tokens.append((TOKEN_TYPES['OPERATOR'], op, self.lineNumber))
-            self.currentPosition += 1
+            self.addToken(TOKEN_TYPES['OPERATOR'], startPosition, startPosition + 1)
         elif op in SEPARATORS:
-            self.tokens.append((TOKEN_TYPES['SEPARATOR'], op, self.lineNumber))
-            self.currentPosition += 1
+            self.addToken(TOKEN_TYPES['SEPARATOR'], startPosition, startPosition + 1)
         else:
-            self.tokens.append((TOKEN_TYPES['UNKNOWN'], op, self.lineNumber))
-            self.currentPosition += 1
+            self.addToken(TOKEN_TYPES['UNKNOWN'], startPosition, startPosition + 1)
+        self.currentPosition += 1
 
 
 def lexer(sourceCode):
@@ -1,28 +1,130 @@
+import argparse
+import contextlib
+import glob
+import io
 import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from compile_cache import CompileCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES
+from instructions import InstrTable, listing_symbols
 from lexer import Lexer
 from parser import Parser
+from profiler import Profiler, stage
+from syntax_tree import TreeParser
 
 
-def run_test_on_file(file_path):
+def compile_file(file_path, stream=False, optimize=False, echo=False, binary=False, profiler=None,
+                 ast=False):
     """
-    Runs the parser on a single file.
+    Lexes and parses one file and writes its listing to the .out file next
+    to it, plus the packed instruction and symbol tables to a .bin file if
+    binary is set. The listing is only printed when echo is set. Returns
+    True if the file parsed.
+    With stream=True tokens are lexed lazily from the open file as the
+    parser asks for them, so the source and token list are never held whole.
+    With optimize=True constants are folded while parsing and the peephole
+    pass runs before the listing is written.
+    With ast=True the file is parsed into a syntax tree and compiled from
+    it (see syntax_tree.TreeParser); the output is the same.
+    Each stage is recorded on profiler, if given.
+    """
+    stem = os.path.splitext(file_path)[0]
+    with open(file_path, 'r') as f:
+        with stage(profiler, 'lex') as record:
+            if stream:
+                tokens = Lexer.iterTokens(f)
+                source = None
+            else:
+                source = f.read()
+                tokens = Lexer(source).lex()
+                record.tokens = len(tokens)
+
+        parser_class = TreeParser if ast else Parser
+        parser = parser_class(tokens, fold_constants=optimize, profiler=profiler, source=source)
+        return parser.parse(stem + ".out", optimize, echo,
+                            stem + ".bin" if binary else None)
+
+
+def compile_with_cache(file_path, stream=False, optimize=False, echo=False, binary=False, cache=None,
+                       ast=False):
+    """
+    compile_file through a CompileCache. On a hit the cached listing or
+    error is written to the .out file (and the .bin rebuilt from it) and
+    the console output of Parser.parse is replayed.
+    Returns (success, cached).
+    """
+    if cache is None:
+        return compile_file(file_path, stream, optimize, echo, binary, ast=ast), False
+
+    stem = os.path.splitext(file_path)[0]
+    # Error text depends on the options too: stream mode has no source to
+    # quote, and a file with both a syntax and a semantic error reports the
+    # first it meets, which can differ with ast
+    key = cache.key(file_path, f"optimize={optimize} stream={stream}" + (" ast" if ast else ""))
+    text = cache.get(key)
+    if text is None:
+        success = compile_file(file_path, stream, optimize, echo, binary, ast=ast)
+        with open(stem + ".out", 'r') as f:
+            cache.put(key, f.read())
+        return success, False
+
+    with open(stem + ".out", 'w') as f:
+        f.write(text)
+    success = text.startswith("Assembly Code Listing")
+    if success:
+        print("Syntax is correct.")
+        if binary:
+            with open(stem + ".bin", 'wb') as f:
+                f.write(InstrTable.from_listing(text).to_bytes(listing_symbols(text)))
+        if echo:
+            sys.stdout.write("\n" + text)
+    else:
+        print(text, file=sys.stderr)
+    return success, True
+
+
+def make_profiler(profile, file_path):
+    """
+    Builds the Profiler for one file from the (allocations, rules, cprofile)
+    settings of --profile, or returns None when profile is None. cProfile
+    stats go to a .prof file next to the source.
+    """
+    if profile is None:
+        return None
+    allocations, rules, cprofile = profile
+    cprofile_path = os.path.splitext(file_path)[0] + ".prof" if cprofile else None
+    return Profiler(allocations, rules, cprofile_path)
+
+
+def profile_file(file_path, stream=False, optimize=False, echo=False, binary=False, profile=None, ast=False):
+    """
+    compile_file under a profiler built from profile. Profiled compiles skip
+    the cache, since a replayed result has no stages to measure.
+    Returns (success, report text).
+    """
+    profiler = make_profiler(profile, file_path)
+    with profiler:
+        success = compile_file(file_path, stream, optimize, echo, binary, profiler, ast)
+    return success, profiler.report_text()
+
+
+def run_test_on_file(file_path, stream=False, optimize=False, binary=False, cache=None, profile=None,
+                     ast=False):
+    """
+    Runs the parser on a single file, echoing the listing.
     """
-    output_filename = os.path.splitext(file_path)[0] + ".out"
     print(f"Running test on {file_path}")
     try:
-        with open(file_path, 'r') as f:
-            source_code = f.read()
+        if profile is None:
+            success, _ = compile_with_cache(file_path, stream, optimize, True, binary, cache, ast)
+        else:
+            success, report = profile_file(file_path, stream, optimize, True, binary, profile, ast)
+            print(report, file=sys.stderr)
     except FileNotFoundError:
         print(f"Error: File '{file_path}' not found.", file=sys.stderr)
         return
 
-    lexer = Lexer(source_code)
-    tokens = lexer.lex()
-
-    parser = Parser(tokens)
-    success = parser.parse(output_filename)
-
     if success:
         print(f"Result: {os.path.basename(file_path)} - PASSED")
     else:
@@ -32,7 +134,134 @@ def run_test_on_file(file_path):
     print()
 
 
-if __name__ == '__main__':
+def expand_paths(patterns):
+    """
+    Expands files, glob patterns and directories (searched recursively for
+    .rat25 files) into a sorted list of unique file paths.
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                paths.update(os.path.join(root, name)
+                             for name in files if name.endswith('.rat25'))
+        elif glob.has_magic(pattern):
+            paths.update(glob.glob(pattern, recursive=True))
+        else:
+            paths.add(pattern)
+    return sorted(paths)
+
+
+def batch_compile(job):
+    """
+    Process pool worker: compiles one file with the parser's console output
+    captured. Returns (file_path, success, message, seconds, cached, report)
+    where report is the profile text, or None when not profiling.
+    """
+    file_path, stream, optimize, binary, cache, profile, ast = job
+    captured = io.StringIO()
+    cached = False
+    report = None
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(captured), contextlib.redirect_stderr(captured):
+            if profile is None:
+                success, cached = compile_with_cache(file_path, stream, optimize, False, binary, cache, ast)
+            else:
+                success, report = profile_file(file_path, stream, optimize, False, binary, profile, ast)
+        message = "" if success else captured.getvalue().strip()
+    except Exception as e:
+        # Unreadable files, undecodable text and any other failure are
+        # reported against this file; the rest of the batch carries on
+        success = False
+        message = str(e)
+    return file_path, success, message, time.perf_counter() - start, cached, report
+
+
+def run_batch(paths, workers=None, chunksize=1, stream=False, optimize=False, binary=False, cache=None,
+              profile=None, ast=False):
+    """
+    Compiles every path across a process pool and prints one line per file
+    plus a PASSED/FAILED summary. Listings are not echoed; with profile set
+    each file's profile follows its line. Returns the number of failures.
+    """
+    jobs = [(path, stream, optimize, binary, cache, profile, ast) for path in paths]
+    start = time.perf_counter()
+    if workers == 1:
+        results = map(batch_compile, jobs)
+        executor = contextlib.nullcontext()
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(batch_compile, jobs, chunksize=chunksize)
+
+    passed = failed = hits = 0
+    with executor:
+        for file_path, success, message, seconds, cached, report in results:
+            hits += cached
+            note = " (cached)" if cached else ""
+            if success:
+                passed += 1
+                print(f"PASSED  {seconds:8.3f}s  {file_path}{note}")
+            else:
+                failed += 1
+                print(f"FAILED  {seconds:8.3f}s  {file_path}{note}: {message}")
+            if report is not None:
+                print(report)
+
+    elapsed = time.perf_counter() - start
+    print(f"\n{len(jobs)} files: {passed} PASSED, {failed} FAILED in {elapsed:.3f}s")
+    if cache is not None:
+        evicted = cache.evict()
+        print(f"Cache: {hits} hits, {len(jobs) - hits} misses, {evicted} evicted")
+    return failed
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description="Compile Rat25F files. With no paths, prompts for files one at a time.")
+    arg_parser.add_argument('paths', nargs='*',
+                            help=".rat25 files, glob patterns or directories to compile in batch")
+    arg_parser.add_argument('--stream', action='store_true',
+                            help="lex each file lazily while parsing")
+    arg_parser.add_argument('--optimize', action='store_true',
+                            help="fold constants and run the peephole pass")
+    arg_parser.add_argument('--binary', action='store_true',
+                            help="also write the packed instruction and symbol tables to a .bin next to each .out")
+    arg_parser.add_argument('--ast', action='store_true',
+                            help="build a syntax tree and generate code from it instead of while parsing")
+    arg_parser.add_argument('--workers', type=int, default=None,
+                            help="batch worker processes (default: CPU count, 1 runs in-process)")
+    arg_parser.add_argument('--chunksize', type=int, default=1,
+                            help="files handed to a worker at a time")
+    arg_parser.add_argument('--no-cache', action='store_true',
+                            help="always recompile instead of replaying cached results")
+    arg_parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                            help="compile cache directory")
+    arg_parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                            help="compile cache size cap in MB; least recently used entries are evicted")
+    arg_parser.add_argument('--profile', action='store_true',
+                            help="report time, token and instruction counts per stage (bypasses the cache)")
+    arg_parser.add_argument('--profile-rules', action='store_true',
+                            help="with --profile, also time every grammar rule")
+    arg_parser.add_argument('--profile-allocations', action='store_true',
+                            help="with --profile, also trace allocations per stage")
+    arg_parser.add_argument('--cprofile', action='store_true',
+                            help="with --profile, also write cProfile stats to a .prof next to each .out")
+    args = arg_parser.parse_args(argv)
+    cache = None if args.no_cache else CompileCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    profile = None
+    if args.profile:
+        profile = (args.profile_allocations, args.profile_rules, args.cprofile)
+
+    if args.paths:
+        paths = expand_paths(args.paths)
+        if not paths:
+            print("No .rat25 files found.", file=sys.stderr)
+            return 1
+        failed = run_batch(paths, args.workers, args.chunksize,
+                           args.stream, args.optimize, args.binary, cache, profile, args.ast)
+        return 1 if failed else 0
+
     while True:
         try:
             filename = input(
@@ -44,8 +273,15 @@ if __name__ == '__main__':
                       file=sys.stderr)
                 continue
 
-            run_test_on_file(filename)
+            run_test_on_file(filename, args.stream, args.optimize, args.binary, cache, profile, args.ast)
 
         except (KeyboardInterrupt, EOFError):
             print("\nExiting.")
             break
+    if cache is not None:
+        cache.evict()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
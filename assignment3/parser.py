@@ -1,120 +1,313 @@
+import argparse
+import contextlib
 import sys
-from lexer import Lexer
+from lexer import Lexer, LineIndex
+from instructions import InstrTable, OPERAND_MAX, REAL_OPS, fold_binary, listing_text, real_to_oprnd
+import peephole
+from profiler import Profiler, stage
+from symbol_table import SymbolTable, UNKNOWN, INTEGER, BOOLEAN, REAL, TYPE_NAMES, assignable
+
+# Trace levels: which of matched tokens and applied productions are written
+# to the trace sink
+TRACE_LEVELS = ('off', 'tokens', 'productions', 'full')
+
+# Methods timed by a Profiler with rules=True: one per grammar rule, plus
+# the code generation helpers they call
+GRAMMAR_RULES = (
+    'rat25f', 'opt_function_definitions', 'function_definitions',
+    'function_definitions_prime', 'function', 'opt_parameter_list',
+    'parameter_list', 'parameter_list_prime', 'parameter', 'qualifier', 'body',
+    'opt_declaration_list', 'declaration_list', 'declaration_list_prime',
+    'declaration', 'ids_decl', 'ids_prime_decl', 'ids_parse_only',
+    'ids_prime_parse_only', 'ids_scan', 'ids_prime_scan', 'statement_list',
+    'statement_list_prime', 'statement', 'compound', 'assign', '_if', 'if_tail',
+    '_return', 'return_tail', 'print_statement', 'scan', '_while', 'condition',
+    'relop', 'expression', 'expression_prime', 'term', 'term_prime', 'factor',
+    'primary', 'primary_tail', 'call',
+)
+CODEGEN_HELPERS = ('gen_instr', 'gen_binary', 'gen_load', 'gen_store', 'back_patch')
+
+# Keywords that start a statement, besides '{' and an identifier
+STATEMENT_KEYWORDS = ('if', 'return', 'put', 'get', 'while')
+
+
+def starts_statement(token):
+    return bool(token) and (token[1] == '{' or token[0] == 'IDENTIFIER' or token[1] in STATEMENT_KEYWORDS)
+
+
+def error_text(message, token, source=None):
+    # A parser error message reported at token (None for end of file). With
+    # a lexer.LineIndex as source, the offending line and a caret follow.
+    if not token:
+        return f"Parser error at end of file: {message}"
+    token_type, lexeme, line_number = token[:3]
+    text = f"Parser error at line {line_number}: Unexpected token '{lexeme}' of type {token_type}. {message}"
+    if source is not None and len(token) == 5:
+        text += "\n" + source.caret(token[3], token[4])
+    return text
 
 
 class Parser:
-    def __init__(self, tokens):
+    def __init__(self, tokens, trace='off', trace_sink=None, fold_constants=False, profiler=None,
+                 source=None):
+        # Any iterable of (type, lexeme, line, start, end) tokens: a list or a
+        # generator such as Lexer.iterTokens. Only one token of lookahead is
+        # held, so a generator feed interleaves lexing with parsing and never
+        # materializes the token list.
         self.tokens = tokens
+        self.token_iter = iter(tokens)
         self.pos = 0
-        self.current_token = self.tokens[self.pos] if self.pos < len(
-            self.tokens) else None
-        self.output = []
+        self.current_token = next(self.token_iter, None)
+
+        # The source text (or a lexer.LineIndex over it) the tokens came
+        # from. When given, errors quote the offending line with a caret
+        # under the token; the index is only built if an error is raised.
+        self.source = source
+        # (message, token) of the error being raised, for callers that
+        # render it again later against edited source (see incremental.py)
+        self.error_at = None
+
+        # Trace lines are written to trace_sink (any object with write(),
+        # stdout by default) as they happen instead of being kept in memory.
+        # With trace='off' nothing is formatted at all.
+        if trace not in TRACE_LEVELS:
+            raise ValueError(f"Unknown trace level '{trace}'")
+        self.trace_tokens = trace in ('tokens', 'full')
+        self.trace_productions = trace in ('productions', 'full')
+        self.trace_sink = trace_sink if trace_sink is not None else sys.stdout
 
         # Assignment 3: Symbol Table and Instruction Table
-        self.symbol_table = {}  # {lexeme: {'address': addr, 'type': type}}
-        # List of {'address': i, 'op': op, 'oprnd': oprnd}
-        self.instr_table = []
+        # Declared identifiers; addresses run contiguously from 10000
+        self.symbol_table = SymbolTable()
+        # Opcode and operand arrays; iterating gives Instr(address, op, oprnd)
+        self.instr_table = InstrTable()
         self.instr_address = 1
-        self.memory_address = 10000
         self.jump_stack = []
+        # Function whose body is being parsed, or None in the main program
+        self.current_function = None
+        # Callee of each CALL address whose result type was UNKNOWN
+        self.unknown_results = {}
+        # Fold constant operands of + - * / and unary minus into one PUSHI
+        self.fold_constants = fold_constants
+
+        # parse() records its stages on the profiler, if any; a profiler
+        # with rules=True also times every grammar rule
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.instrument(self, GRAMMAR_RULES + CODEGEN_HELPERS)
 
     def log_production(self, rule):
-        self.output.append("    " + rule)
+        if self.trace_productions:
+            self.trace_sink.write("    " + rule + "\n")
 
     def advance(self):
         self.pos += 1
-        self.current_token = self.tokens[self.pos] if self.pos < len(
-            self.tokens) else None
+        self.current_token = next(self.token_iter, None)
 
     def match(self, token_type, token_value=None):
         if self.current_token and self.current_token[0] == token_type:
             if token_value is None or self.current_token[1] == token_value:
-                self.output.append(
-                    f"Token: {self.current_token[0].capitalize()}, Lexeme: {self.current_token[1]}")
+                if self.trace_tokens:
+                    self.trace_sink.write(
+                        f"Token: {self.current_token[0].capitalize()}, Lexeme: {self.current_token[1]}\n")
                 self.advance()
                 return True
         return False
 
-    def error(self, message):
-        if self.current_token:
-            token_type, lexeme, line_number = self.current_token
-            error_message = f"Parser error at line {line_number}: Unexpected token '{lexeme}' of type {token_type}. {message}"
-        else:
-            error_message = f"Parser error at end of file: {message}"
-        raise Exception(error_message)
+    def error(self, message, token=None):
+        # Reports at token, by default the current one
+        token = token or self.current_token
+        self.error_at = (message, token)
+        if self.source is not None and not isinstance(self.source, LineIndex):
+            self.source = LineIndex(self.source)
+        raise Exception(error_text(message, token, self.source))
 
     # --- Assignment 3 Helper Methods ---
 
     def gen_instr(self, op, oprnd):
-        self.instr_table.append(
-            {'address': self.instr_address, 'op': op, 'oprnd': oprnd})
+        self.instr_table.append(op, oprnd)
         self.instr_address += 1
         return self.instr_address - 1
 
+    def gen_binary(self, op, left_addr, right_addr):
+        # Emits a binary op whose operands' code starts at left_addr and
+        # right_addr. If each operand is a single PUSHI and folding is on,
+        # both are replaced by one PUSHI of the result. fold_binary declines
+        # division by zero, which keeps its runtime error.
+        if self.fold_constants and right_addr == left_addr + 1 and self.instr_address == right_addr + 1:
+            left = self.instr_table[left_addr - 1]
+            right = self.instr_table[right_addr - 1]
+            if left.op == 'PUSHI' and right.op == 'PUSHI':
+                value = fold_binary(op, left.oprnd, right.oprnd)
+                if value is not None:
+                    self.instr_table.truncate(left_addr - 1)
+                    self.instr_address = left_addr
+                    return self.gen_instr('PUSHI', value)
+        return self.gen_instr(op, None)
+
     def back_patch(self, jump_addr):
         addr = self.jump_stack.pop()
-        # Instr table is 0-indexed, addresses are 1-based
-        # We need to find the instruction with address == addr
-        # Since we append sequentially, index = addr - 1
+        # Addresses are 1-based and assigned sequentially, so the
+        # instruction with address == addr is the addr-th one
         if 0 <= addr - 1 < len(self.instr_table):
-            self.instr_table[addr-1]['oprnd'] = jump_addr
+            self.instr_table.set_oprnd(addr, jump_addr)
         else:
             raise Exception(f"Backpatch error: Invalid address {addr}")
 
-    def insert_symbol(self, lexeme, type_):
-        if lexeme in self.symbol_table:
+    def insert_symbol(self, lexeme, type_, position=None):
+        # position is the stream index of the declaring identifier
+        if self.symbol_table.insert(lexeme, type_, position) is None:
             self.error(f"Identifier '{lexeme}' already declared.")
-        self.symbol_table[lexeme] = {
-            'address': self.memory_address, 'type': type_}
-        self.memory_address += 1
 
-    def get_address(self, lexeme):
-        if lexeme not in self.symbol_table:
+    def get_symbol(self, lexeme):
+        symbol = self.symbol_table.lookup(lexeme)
+        if symbol is None:
             self.error(f"Identifier '{lexeme}' not declared.")
-        return self.symbol_table[lexeme]['address']
+        return symbol
+
+    def get_address(self, lexeme):
+        return self.get_symbol(lexeme).address
 
     def get_type(self, lexeme):
-        if lexeme not in self.symbol_table:
-            self.error(f"Identifier '{lexeme}' not declared.")
-        return self.symbol_table[lexeme]['type']
+        return self.get_symbol(lexeme).type
+
+    def gen_arith(self, op, left_addr, right_addr, left_type, right_type, token):
+        # Type checks and emits an arithmetic op and returns the result
+        # type. Two integers cost one comparison; a real on either side
+        # selects the real op, which takes integer operands as they are.
+        # UNKNOWN operands are taken as integers. Errors are reported at
+        # token, the operator.
+        if not (left_type and right_type):
+            self.expect_type(left_type, right_addr, INTEGER, token)
+            self.expect_type(right_type, self.instr_address, INTEGER, token)
+        types = left_type | right_type
+        if types == INTEGER:
+            self.gen_binary(op, left_addr, right_addr)
+            return INTEGER
+        if types & BOOLEAN:
+            self.error(f"Type mismatch: arithmetic on {TYPE_NAMES[left_type]} and {TYPE_NAMES[right_type]}.",
+                       token)
+        if types & REAL:
+            self.gen_instr(REAL_OPS[op], None)
+            return REAL
+        self.gen_binary(op, left_addr, right_addr)
+        return INTEGER
+
+    def gen_compare(self, op, left_type, right_type, right_addr, token):
+        # Type checks and emits a comparison; op is EQU, NEQ, GRT, LES, LEQ
+        # or GEQ and token the relational operator. Numbers compare with
+        # numbers, booleans only for (in)equality. An UNKNOWN call result
+        # must match the other side; two of them are constrained only by
+        # an ordering.
+        if not (left_type and right_type):
+            ordering = None if op in ('EQU', 'NEQ') else INTEGER
+            self.expect_type(left_type, right_addr, right_type or ordering, token)
+            self.expect_type(right_type, self.instr_address, left_type or ordering, token)
+        types = left_type | right_type
+        if types != INTEGER:
+            if types & BOOLEAN:
+                if types != BOOLEAN or op not in ('EQU', 'NEQ'):
+                    self.error(f"Type mismatch: cannot compare {TYPE_NAMES[left_type]} "
+                               f"and {TYPE_NAMES[right_type]} with {token[1]}.", token)
+            elif types & REAL:
+                op = REAL_OPS[op]
+        self.gen_instr(op, None)
+
+    def expect_type(self, type_, end_addr, target, token):
+        # A value of type UNKNOWN is the result of the CALL just before
+        # end_addr. Its use as a target value (None for any) is checked now
+        # if the callee's return type has been found since, or when it is.
+        # A function whose definition ended without a typed return returns
+        # 0 or nothing, which any use accepts.
+        if type_ != UNKNOWN or target is None:
+            return
+        function = self.unknown_results[end_addr - 1]
+        if function.type is not None:
+            self.check_use(function, function.type, target, token, token)
+        elif function.entry is None or function is self.current_function:
+            function.uses.append((target, token))
+
+    def check_use(self, function, type_, target, use, token):
+        # Reports at token when function, now known to return type_, had
+        # its result used as target at the token use
+        if not assignable(target, type_):
+            self.error(f"Type mismatch: function '{function.name}' returns {TYPE_NAMES[type_]} but its "
+                       f"result is used as {TYPE_NAMES[target]} on line {use[2]}.", token)
+
+    def gen_load(self, symbol):
+        # Globals live in memory; locals are addressed from the frame
+        # pointer. Reals have their own memory and local slots.
+        if symbol.type_code == REAL:
+            return self.gen_instr('PUSHLR' if symbol.local else 'PUSHMR', symbol.address)
+        return self.gen_instr('PUSHL' if symbol.local else 'PUSHM', symbol.address)
+
+    def gen_store(self, symbol):
+        # Storing an integer into a real slot converts it
+        if symbol.type_code == REAL:
+            return self.gen_instr('POPLR' if symbol.local else 'POPMR', symbol.address)
+        return self.gen_instr('POPL' if symbol.local else 'POPM', symbol.address)
 
     def print_symbol_table(self):
-        print("\nSymbol Table")
-        print(f"{'Identifier':<15} {'MemoryLocation':<20} {'Type':<10}")
-        for lexeme, data in self.symbol_table.items():
-            print(f"{lexeme:<15} {data['address']:<20} {data['type']:<10}")
+        print("\n" + "\n".join(self.symbol_table_lines()))
+
+    def symbol_table_lines(self):
+        # Globals, then each function's parameters and locals by frame offset
+        yield "Symbol Table"
+        yield f"{'Identifier':<15} {'MemoryLocation':<20} {'Type':<10}"
+        for symbol in self.symbol_table:
+            yield f"{symbol.name:<15} {symbol.address:<20} {symbol.type:<10}"
+        for function, symbols in self.symbol_table.frames:
+            yield ""
+            yield f"Function {function}"
+            for symbol in symbols:
+                yield f"{symbol.name:<15} {'FP+' + str(symbol.address):<20} {symbol.type:<10}"
 
     def print_assembly(self):
         print("\nAssembly Code Listing")
-        for instr in self.instr_table:
-            oprnd = instr['oprnd'] if instr['oprnd'] is not None else ""
-            print(f"{instr['address']:<4} {instr['op']:<6} {oprnd}")
-
-    def parse(self, output_filename="parser_output.txt"):
+        for line in self.instr_table.listing_lines():
+            print(line)
+
+    def optimize(self):
+        # Peephole pass over the finished instruction table
+        count = len(self.instr_table)
+        self.instr_table, removed = peephole.optimize(self.instr_table)
+        self.instr_address = len(self.instr_table) + 1
+        return removed, count
+
+    def symbol_table_text(self):
+        return "\n".join(self.symbol_table_lines())
+
+    def listing_text(self):
+        # The whole .out listing
+        return listing_text(self.instr_table, self.symbol_table_text())
+
+    def parse(self, output_filename="parser_output.txt", optimize=False, echo=False, binary_filename=None):
+        # The listing is written with a single call and only echoed to the
+        # console when echo is set. binary_filename also writes the packed
+        # instruction and symbol tables (see InstrTable.to_bytes).
         try:
-            self.rat25f()
+            with stage(self.profiler, 'parse') as record:
+                self.rat25f()
+                record.tokens = self.pos
+                record.instructions = len(self.instr_table)
             print("Syntax is correct.")
-            
-            with open(output_filename, "w") as f:
-                # Write Assembly Code
-                f.write("Assembly Code Listing\n")
-                print("\nAssembly Code Listing")
-                for instr in self.instr_table:
-                    oprnd = instr['oprnd'] if instr['oprnd'] is not None else ""
-                    line = f"{instr['address']:<4} {instr['op']:<6} {oprnd}"
-                    f.write(line + "\n")
-                    print(line)
-                
-                # Write Symbol Table
-                f.write("\nSymbol Table\n")
-                f.write(f"{'Identifier':<15} {'MemoryLocation':<20} {'Type':<10}\n")
-                print("\nSymbol Table")
-                print(f"{'Identifier':<15} {'MemoryLocation':<20} {'Type':<10}")
-                for lexeme, data in self.symbol_table.items():
-                    line = f"{lexeme:<15} {data['address']:<20} {data['type']:<10}"
-                    f.write(line + "\n")
-                    print(line)
-                    
+            if optimize:
+                with stage(self.profiler, 'optimize') as record:
+                    removed, count = self.optimize()
+                    record.instructions = len(self.instr_table)
+                print(f"Peephole: removed {removed} of {count} instructions.")
+
+            with stage(self.profiler, 'listing') as record:
+                text = self.listing_text()
+                record.instructions = len(self.instr_table)
+            with stage(self.profiler, 'write'):
+                with open(output_filename, "w") as f:
+                    f.write(text)
+                if binary_filename is not None:
+                    with open(binary_filename, "wb") as f:
+                        f.write(self.instr_table.to_bytes(self.symbol_table_text()))
+            if echo:
+                sys.stdout.write("\n" + text)
             return True
         except Exception as e:
             print(e, file=sys.stderr)
@@ -127,20 +320,33 @@ class Parser:
     def rat25f(self):
         self.log_production(
             "<Rat25F> ::= <Opt Function Definitions> # <Opt Declaration List> <Statement List> #")
+        self.program_head()
+        self.statement_list()
+        self.program_end()
+
+    # The parts of <Rat25F> around the statement list, which an incremental
+    # parse runs on their own
+    def program_head(self):
         self.opt_function_definitions()
         if not self.match('SEPARATOR', '#'):
             self.error("Expected '#' after function definitions")
         self.opt_declaration_list()
-        self.statement_list()
+
+    def program_end(self):
         if not self.match('SEPARATOR', '#'):
             self.error("Expected '#' at the end of the program")
 
     def opt_function_definitions(self):
-        # Simplified Rat25F: No function definitions expected
         if self.current_token and self.current_token[1] == 'function':
             self.log_production(
                 "<Opt Function Definitions> ::= <Function Definitions>")
+            # Function code comes first; jump over it to the main program
+            self.jump_stack.append(self.gen_instr('JUMP', None))
             self.function_definitions()
+            for function in self.symbol_table.functions.values():
+                if function.entry is None:
+                    self.error(f"Function '{function.name}' not defined.", function.calls[0][2])
+            self.back_patch(self.instr_address)
         else:
             self.log_production("<Opt Function Definitions> ::= <Empty>")
 
@@ -150,29 +356,73 @@ class Parser:
         self.function()
         self.function_definitions_prime()
 
+    # The tail-recursive <...'> productions below are unrolled into loops so
+    # long lists do not grow the Python stack. Each iteration logs the same
+    # production the recursive call would have.
     def function_definitions_prime(self):
-        if self.current_token and self.current_token[1] == 'function':
+        while self.current_token and self.current_token[1] == 'function':
             self.log_production(
                 "<Function Definitions'> ::= <Function> <Function Definitions'>")
             self.function()
-            self.function_definitions_prime()
-        else:
-            self.log_production("<Function Definitions'> ::= <Empty>")
+        self.log_production("<Function Definitions'> ::= <Empty>")
 
     def function(self):
         self.log_production(
             "<Function> ::= function <Identifier> ( <Opt Parameter List> ) <Opt Declaration List> <Body>")
         if not self.match('KEYWORD', 'function'):
             self.error("Expected 'function'")
-        if not self.match('IDENTIFIER'):
+        if not self.current_token or self.current_token[0] != 'IDENTIFIER':
             self.error("Expected identifier")
+        name = self.current_token[1]
+        function = self.symbol_table.function(name)
+        if function.entry is not None:
+            self.error(f"Function '{name}' already defined.")
+        function.position = self.pos
+        self.match('IDENTIFIER')
+        # Parameters and locals live in the function's own scope
+        self.symbol_table.enter_scope(name)
         if not self.match('SEPARATOR', '('):
             self.error("Expected '('")
         self.opt_parameter_list()
         if not self.match('SEPARATOR', ')'):
             self.error("Expected ')'")
+        function.param_types = self.symbol_table.scope_types()
         self.opt_declaration_list()
+
+        # Prologue: ENTER allocates the frame, then the arguments the caller
+        # pushed are popped into the parameter slots, last one first
+        function.entry = self.gen_instr('ENTER', self.symbol_table.scope_size())
+        for offset in reversed(range(len(function.param_types))):
+            self.gen_instr('POPLR' if function.param_types[offset] == REAL else 'POPL', offset)
+        for call_addr, arg_types, token, arg_ends in function.calls:
+            self.check_arguments(function, arg_types, arg_ends, token)
+            self.instr_table.set_oprnd(call_addr, function.entry)
+        function.calls.clear()
+
+        self.current_function = function
         self.body()
+        # Falling off the end returns 0
+        self.gen_return_zero()
+        self.gen_instr('RET', None)
+        self.current_function = None
+        self.symbol_table.exit_scope()
+
+    def check_arguments(self, function, arg_types, arg_ends, token):
+        # arg_ends holds the address after each argument's code
+        params = len(function.param_types)
+        if len(arg_types) != params:
+            self.error(f"Function '{function.name}' takes {params} arguments, got {len(arg_types)}.", token)
+        for position, (arg_type, param_type) in enumerate(zip(arg_types, function.param_types), 1):
+            self.expect_type(arg_type, arg_ends[position - 1], param_type, token)
+            if not assignable(param_type, arg_type):
+                self.error(f"Type mismatch: argument {position} of '{function.name}' must be "
+                           f"{TYPE_NAMES[param_type]}, got {TYPE_NAMES[arg_type]}.", token)
+
+    def gen_return_zero(self):
+        if self.current_function is not None and self.current_function.type == REAL:
+            self.gen_instr('PUSHR', real_to_oprnd(0.0))
+        else:
+            self.gen_instr('PUSHI', 0)
 
     def opt_parameter_list(self):
         if self.current_token and self.current_token[0] == 'IDENTIFIER':
@@ -188,20 +438,18 @@ class Parser:
         self.parameter_list_prime()
 
     def parameter_list_prime(self):
-        if self.match('SEPARATOR', ','):
+        while self.match('SEPARATOR', ','):
             self.log_production(
                 "<Parameter List'> ::= , <Parameter> <Parameter List'>")
             self.parameter()
-            self.parameter_list_prime()
-        else:
-            self.log_production("<Parameter List'> ::= <Empty>")
+        self.log_production("<Parameter List'> ::= <Empty>")
 
     def parameter(self):
         self.log_production("<Parameter> ::= <IDs> <Qualifier>")
         ids_list = self.ids_parse_only()
         type_ = self.qualifier()
-        for lexeme in ids_list:
-            self.insert_symbol(lexeme, type_)
+        for lexeme, position in ids_list:
+            self.insert_symbol(lexeme, type_, position)
 
     def qualifier(self):
         self.log_production("<Qualifier> ::= integer | boolean | real")
@@ -210,7 +458,7 @@ class Parser:
         if self.match('KEYWORD', 'boolean'):
             return 'boolean'
         if self.match('KEYWORD', 'real'):
-            self.error("Type 'real' is not allowed in Simplified Rat25F")
+            return 'real'
         self.error("Expected a qualifier")
 
     def body(self):
@@ -238,15 +486,13 @@ class Parser:
         self.declaration_list_prime()
 
     def declaration_list_prime(self):
-        if self.current_token and self.current_token[0] == 'KEYWORD' and self.current_token[1] in ['integer', 'boolean', 'real']:
+        while self.current_token and self.current_token[0] == 'KEYWORD' and self.current_token[1] in ['integer', 'boolean', 'real']:
             self.log_production(
                 "<Declaration List'> ::= <Declaration> ; <Declaration List'>")
             self.declaration()
             if not self.match('SEPARATOR', ';'):
                 self.error("Expected ';'")
-            self.declaration_list_prime()
-        else:
-            self.log_production("<Declaration List'> ::= <Empty>")
+        self.log_production("<Declaration List'> ::= <Empty>")
 
     def declaration(self):
         self.log_production("<Declaration> ::= <Qualifier> <IDs>")
@@ -256,31 +502,30 @@ class Parser:
     def ids_decl(self, type_):
         self.log_production("<IDs> ::= <Identifier> <IDs'>")
         if self.current_token and self.current_token[0] == 'IDENTIFIER':
-            lexeme = self.current_token[1]
+            lexeme, position = self.current_token[1], self.pos
             self.match('IDENTIFIER')
-            self.insert_symbol(lexeme, type_)
+            self.insert_symbol(lexeme, type_, position)
             self.ids_prime_decl(type_)
         else:
             self.error("Expected identifier")
 
     def ids_prime_decl(self, type_):
-        if self.match('SEPARATOR', ','):
+        while self.match('SEPARATOR', ','):
             self.log_production("<IDs'> ::= , <Identifier> <IDs'>")
             if self.current_token and self.current_token[0] == 'IDENTIFIER':
-                lexeme = self.current_token[1]
+                lexeme, position = self.current_token[1], self.pos
                 self.match('IDENTIFIER')
-                self.insert_symbol(lexeme, type_)
-                self.ids_prime_decl(type_)
+                self.insert_symbol(lexeme, type_, position)
             else:
                 self.error("Expected identifier")
-        else:
-            self.log_production("<IDs'> ::= <Empty>")
+        self.log_production("<IDs'> ::= <Empty>")
 
     def ids_parse_only(self):
+        # The (lexeme, stream index) of each identifier
         self.log_production("<IDs> ::= <Identifier> <IDs'>")
         lexemes = []
         if self.current_token and self.current_token[0] == 'IDENTIFIER':
-            lexemes.append(self.current_token[1])
+            lexemes.append((self.current_token[1], self.pos))
             self.match('IDENTIFIER')
             lexemes.extend(self.ids_prime_parse_only())
         else:
@@ -289,44 +534,38 @@ class Parser:
 
     def ids_prime_parse_only(self):
         lexemes = []
-        if self.match('SEPARATOR', ','):
+        while self.match('SEPARATOR', ','):
             self.log_production("<IDs'> ::= , <Identifier> <IDs'>")
             if self.current_token and self.current_token[0] == 'IDENTIFIER':
-                lexemes.append(self.current_token[1])
+                lexemes.append((self.current_token[1], self.pos))
                 self.match('IDENTIFIER')
-                lexemes.extend(self.ids_prime_parse_only())
             else:
                 self.error("Expected identifier")
-        else:
-            self.log_production("<IDs'> ::= <Empty>")
+        self.log_production("<IDs'> ::= <Empty>")
         return lexemes
 
     def ids_scan(self):
         self.log_production("<IDs> ::= <Identifier> <IDs'>")
         if self.current_token and self.current_token[0] == 'IDENTIFIER':
-            lexeme = self.current_token[1]
-            addr = self.get_address(lexeme)
+            symbol = self.get_symbol(self.current_token[1])
             self.match('IDENTIFIER')
-            self.gen_instr('STDIN', None)
-            self.gen_instr('POPM', addr)
+            self.gen_instr('STDINR' if symbol.type_code == REAL else 'STDIN', None)
+            self.gen_store(symbol)
             self.ids_prime_scan()
         else:
             self.error("Expected identifier")
 
     def ids_prime_scan(self):
-        if self.match('SEPARATOR', ','):
+        while self.match('SEPARATOR', ','):
             self.log_production("<IDs'> ::= , <Identifier> <IDs'>")
             if self.current_token and self.current_token[0] == 'IDENTIFIER':
-                lexeme = self.current_token[1]
-                addr = self.get_address(lexeme)
+                symbol = self.get_symbol(self.current_token[1])
                 self.match('IDENTIFIER')
-                self.gen_instr('STDIN', None)
-                self.gen_instr('POPM', addr)
-                self.ids_prime_scan()
+                self.gen_instr('STDINR' if symbol.type_code == REAL else 'STDIN', None)
+                self.gen_store(symbol)
             else:
                 self.error("Expected identifier")
-        else:
-            self.log_production("<IDs'> ::= <Empty>")
+        self.log_production("<IDs'> ::= <Empty>")
 
     def statement_list(self):
         self.log_production(
@@ -335,13 +574,14 @@ class Parser:
         self.statement_list_prime()
 
     def statement_list_prime(self):
-        if self.current_token and (self.current_token[1] == '{' or self.current_token[0] == 'IDENTIFIER' or self.current_token[1] in ['if', 'return', 'put', 'get', 'while']):
+        while self.at_statement_start():
             self.log_production(
                 "<Statement List'> ::= <Statement> <Statement List'>")
             self.statement()
-            self.statement_list_prime()
-        else:
-            self.log_production("<Statement List'> ::= <Empty>")
+        self.log_production("<Statement List'> ::= <Empty>")
+
+    def at_statement_start(self):
+        return starts_statement(self.current_token)
 
     def statement(self):
         if self.current_token:
@@ -382,13 +622,17 @@ class Parser:
     def assign(self):
         self.log_production("<Assign> ::= <Identifier> = <Expression> ;")
         if self.current_token and self.current_token[0] == 'IDENTIFIER':
-            lexeme = self.current_token[1]
-            addr = self.get_address(lexeme)
+            token = self.current_token
+            symbol = self.get_symbol(token[1])
             self.match('IDENTIFIER')
             if not self.match('OPERATOR', '='):
                 self.error("Expected '='")
-            self.expression()
-            self.gen_instr('POPM', addr)
+            type_ = self.expression()
+            if type_ != symbol.type_code and not assignable(symbol.type_code, type_):
+                self.error(f"Type mismatch: cannot assign {TYPE_NAMES[type_]} to {symbol.type} '{symbol.name}'.",
+                           token)
+            self.expect_type(type_, self.instr_address, symbol.type_code, token)
+            self.gen_store(symbol)
             if not self.match('SEPARATOR', ';'):
                 self.error("Expected ';'")
         else:
@@ -448,14 +692,44 @@ class Parser:
         self.return_tail()
 
     def return_tail(self):
+        # The return value is left on the operand stack; a bare return
+        # returns 0. In the main program RET halts.
         if self.current_token and self.current_token[1] == ';':
             self.log_production("<Return_Tail> ::= ;")
             self.match('SEPARATOR', ';')
+            self.gen_return_zero()
         else:
             self.log_production("<Return_Tail> ::= <Expression> ;")
-            self.expression()
+            token = self.current_token
+            self.gen_return_value(self.expression(), token)
             if not self.match('SEPARATOR', ';'):
                 self.error("Expected ';'")
+        self.gen_instr('RET', None)
+
+    def gen_return_value(self, type_, token):
+        # The first return sets a function's return type and a real return
+        # widens an integer one, unless a call has already relied on it.
+        # Integers returned from a real function are converted.
+        function = self.current_function
+        if function is None or type_ == function.type or type_ == UNKNOWN:
+            return
+        if function.type is None:
+            if type_ == REAL and function.called:
+                self.error(f"Type mismatch: function '{function.name}' returns real but was already "
+                           f"used as integer.", token)
+            function.type = type_
+            for target, use in function.uses:
+                self.check_use(function, type_, target, use, token)
+            function.uses.clear()
+        elif function.type == REAL and type_ == INTEGER:
+            self.gen_instr('ITOR', None)
+        elif function.type == INTEGER and type_ == REAL and not function.called:
+            function.type = REAL
+            function.widened = True
+        else:
+            used = "was already used as" if function.called else "already returns"
+            self.error(f"Type mismatch: function '{function.name}' returns {TYPE_NAMES[type_]} but "
+                       f"{used} {TYPE_NAMES[function.type]}.", token)
 
     def print_statement(self):
         self.log_production("<Print> ::= put ( <Expression> );")
@@ -512,22 +786,25 @@ class Parser:
     def condition(self):
         self.log_production(
             "<Condition> ::= <Expression> <Relop> <Expression>")
-        self.expression()
+        left_type = self.expression()
+        token = self.current_token
         op = self.relop()
-        self.expression()
+        right_addr = self.instr_address
+        right_type = self.expression()
 
         if op == '==':
-            self.gen_instr('EQU', None)
+            op = 'EQU'
         elif op == '!=':
-            self.gen_instr('NEQ', None)
+            op = 'NEQ'
         elif op == '>':
-            self.gen_instr('GRT', None)
+            op = 'GRT'
         elif op == '<':
-            self.gen_instr('LES', None)
+            op = 'LES'
         elif op == '<=':
-            self.gen_instr('LEQ', None)
+            op = 'LEQ'
         elif op == '=>':
-            self.gen_instr('GEQ', None)
+            op = 'GEQ'
+        self.gen_compare(op, left_type, right_type, right_addr, token)
 
     def relop(self):
         self.log_production("<Relop> ::= == | != | > | < | <= | =>")
@@ -538,109 +815,212 @@ class Parser:
                 return op
         self.error("Expected relational operator")
 
+    # expression, term, factor and primary return the type code of the
+    # value their code leaves on the stack
     def expression(self):
         self.log_production("<Expression> ::= <Term> <Expression'>")
-        self.term()
-        self.expression_prime()
-
-    def expression_prime(self):
-        if self.current_token and self.current_token[0] == 'OPERATOR' and self.current_token[1] in ['+', '-']:
-            op = self.current_token[1]
+        left_addr = self.instr_address
+        left_type = self.term()
+        return self.expression_prime(left_addr, left_type)
+
+    def expression_prime(self, left_addr, left_type):
+        while self.current_token and self.current_token[0] == 'OPERATOR' and self.current_token[1] in ['+', '-']:
+            token = self.current_token
+            op = token[1]
             self.match('OPERATOR', op)
-            self.log_production(f"<Expression'> ::= {op} <Term> <Expression'>")
-            self.term()
+            if self.trace_productions:
+                self.log_production(f"<Expression'> ::= {op} <Term> <Expression'>")
+            right_addr = self.instr_address
+            right_type = self.term()
             if op == '+':
-                self.gen_instr('ADD', None)
+                left_type = self.gen_arith('ADD', left_addr, right_addr, left_type, right_type, token)
             else:
-                self.gen_instr('SUB', None)
-            self.expression_prime()
-        else:
-            self.log_production("<Expression'> ::= <Empty>")
+                left_type = self.gen_arith('SUB', left_addr, right_addr, left_type, right_type, token)
+        self.log_production("<Expression'> ::= <Empty>")
+        return left_type
 
     def term(self):
         self.log_production("<Term> ::= <Factor> <Term'>")
-        self.factor()
-        self.term_prime()
-
-    def term_prime(self):
-        if self.current_token and self.current_token[0] == 'OPERATOR' and self.current_token[1] in ['*', '/']:
-            op = self.current_token[1]
+        left_addr = self.instr_address
+        left_type = self.factor()
+        return self.term_prime(left_addr, left_type)
+
+    def term_prime(self, left_addr, left_type):
+        while self.current_token and self.current_token[0] == 'OPERATOR' and self.current_token[1] in ['*', '/']:
+            token = self.current_token
+            op = token[1]
             self.match('OPERATOR', op)
-            self.log_production(f"<Term'> ::= {op} <Factor> <Term'>")
-            self.factor()
+            if self.trace_productions:
+                self.log_production(f"<Term'> ::= {op} <Factor> <Term'>")
+            right_addr = self.instr_address
+            right_type = self.factor()
             if op == '*':
-                self.gen_instr('MUL', None)
+                left_type = self.gen_arith('MUL', left_addr, right_addr, left_type, right_type, token)
             else:
-                self.gen_instr('DIV', None)
-            self.term_prime()
-        else:
-            self.log_production("<Term'> ::= <Empty>")
+                left_type = self.gen_arith('DIV', left_addr, right_addr, left_type, right_type, token)
+        self.log_production("<Term'> ::= <Empty>")
+        return left_type
 
     def factor(self):
         if self.current_token and self.current_token[0] == 'OPERATOR' and self.current_token[1] == '-':
+            token = self.current_token
             self.match('OPERATOR', '-')
             self.log_production("<Factor> ::= - <Primary>")
-            self.gen_instr('PUSHI', 0)
-            self.primary()
-            self.gen_instr('SUB', None)
+            left_addr = self.gen_instr('PUSHI', 0)
+            type_ = self.primary()
+            return self.gen_arith('SUB', left_addr, left_addr + 1, INTEGER, type_, token)
         else:
             self.log_production("<Factor> ::= <Primary>")
-            self.primary()
+            return self.primary()
 
     def primary(self):
         if self.current_token and self.current_token[0] == 'IDENTIFIER':
             self.log_production("<Primary> ::= <Identifier> <Primary_Tail>")
-            lexeme = self.current_token[1]
-            addr = self.get_address(lexeme)
+            token = self.current_token
+            symbol = self.symbol_table.lookup(token[1])
             self.match('IDENTIFIER')
-            self.gen_instr('PUSHM', addr)
-            self.primary_tail()
+            return self.primary_tail(token, symbol)
         elif self.current_token and self.current_token[0] == 'INTEGER':
-            val = self.current_token[1]
+            val = int(self.current_token[1])
+            if val > OPERAND_MAX:
+                self.error("Integer literal out of range")
             self.log_production("<Primary> ::= <Integer>")
             self.match('INTEGER')
             self.gen_instr('PUSHI', val)
+            return INTEGER
         elif self.current_token and self.current_token[0] == 'REAL':
-            self.error("Reals not supported")
+            try:
+                val = float(self.current_token[1])
+            except ValueError:
+                self.error("Invalid real")
+            self.log_production("<Primary> ::= <Real>")
+            self.match('REAL')
+            self.gen_instr('PUSHR', real_to_oprnd(val))
+            return REAL
         elif self.current_token and self.current_token[1] == 'true':
             self.log_production("<Primary> ::= true")
             self.match('KEYWORD', 'true')
             self.gen_instr('PUSHI', 1)
+            return BOOLEAN
         elif self.current_token and self.current_token[1] == 'false':
             self.log_production("<Primary> ::= false")
             self.match('KEYWORD', 'false')
             self.gen_instr('PUSHI', 0)
+            return BOOLEAN
         elif self.current_token and self.current_token[1] == '(':
             self.log_production("<Primary> ::= ( <Expression> )")
             self.match('SEPARATOR', '(')
-            self.expression()
+            type_ = self.expression()
             if not self.match('SEPARATOR', ')'):
                 self.error("Expected ')'")
+            return type_
         else:
             self.error("Invalid primary")
 
-    def primary_tail(self):
+    def primary_tail(self, token, symbol):
+        # token is the identifier before the tail; symbol is what it names
+        # as a variable, or None
         if self.current_token and self.current_token[1] == '(':
-            self.error("Function calls not supported")
+            self.log_production("<Primary_Tail> ::= ( <Arguments> )")
+            return self.call(token)
         else:
+            if symbol is None:
+                self.error(f"Identifier '{token[1]}' not declared.", token)
+            self.gen_load(symbol)
             self.log_production("<Primary_Tail> ::= <Empty>")
+            return symbol.type_code
+
+    def call(self, token):
+        # Arguments are pushed left to right; CALL leaves the return value
+        # on the operand stack. Calls from one function to another defined
+        # later are patched when the definition is reached.
+        function = self.symbol_table.function(token[1])
+        self.match('SEPARATOR', '(')
+        arg_types = []
+        arg_ends = []
+        if not (self.current_token and self.current_token[1] == ')'):
+            arg_types.append(self.expression())
+            arg_ends.append(self.instr_address)
+            while self.match('SEPARATOR', ','):
+                arg_types.append(self.expression())
+                arg_ends.append(self.instr_address)
+        if not self.match('SEPARATOR', ')'):
+            self.error("Expected ')'")
+        call_addr = self.gen_instr('CALL', function.entry)
+        if function.entry is not None:
+            self.check_arguments(function, arg_types, arg_ends, token)
+        elif self.symbol_table.scopes:
+            function.calls.append((call_addr, arg_types, token, arg_ends))
+        else:
+            self.error(f"Function '{function.name}' not defined.", token)
+        return self.call_result(function, call_addr)
+
+    def call_result(self, function, call_addr):
+        # Marks function called and returns the type of the value its CALL
+        # leaves. Integer returns emitted before a widening have no ITOR,
+        # so the call converts instead; no call precedes the widening.
+        function.called = True
+        if function.widened:
+            self.gen_instr('ITOR', None)
+            return REAL
+        if function.type is None:
+            self.unknown_results[call_addr] = function
+            return UNKNOWN
+        return function.type
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print("Usage: python3 parser.py <filename>")
-        sys.exit(1)
-
-    filename = sys.argv[1]
+    arg_parser = argparse.ArgumentParser(description="Parse one Rat25F file and write parser_output.txt.")
+    arg_parser.add_argument('filename')
+    arg_parser.add_argument('--stream', action='store_true',
+                            help="lex lazily from the open file while parsing")
+    arg_parser.add_argument('--optimize', action='store_true',
+                            help="fold constants and run the peephole pass before the listing is written")
+    arg_parser.add_argument('--ast', action='store_true',
+                            help="build a syntax tree and generate code from it instead of while parsing")
+    arg_parser.add_argument('--echo', action='store_true',
+                            help="also print the listing to the console")
+    arg_parser.add_argument('--binary', action='store_true',
+                            help="also write the packed instruction and symbol tables to parser_output.bin")
+    arg_parser.add_argument('--profile', action='store_true',
+                            help="print time, token and instruction counts per stage to stderr")
+    arg_parser.add_argument('--profile-rules', action='store_true',
+                            help="with --profile, also time every grammar rule")
+    arg_parser.add_argument('--profile-allocations', action='store_true',
+                            help="with --profile, also trace allocations per stage")
+    arg_parser.add_argument('--cprofile', action='store_true',
+                            help="with --profile, also write cProfile stats to parser_output.prof")
+    args = arg_parser.parse_args()
+
+    filename = args.filename
     try:
-        with open(filename, 'r') as f:
-            source_code = f.read()
+        f = open(filename, 'r')
     except FileNotFoundError:
         print(f"Error: File '{filename}' not found.")
         sys.exit(1)
 
-    lexer = Lexer(source_code)
-    tokens = lexer.lex()
+    profiler = None
+    if args.profile:
+        profiler = Profiler(args.profile_allocations, args.profile_rules,
+                            "parser_output.prof" if args.cprofile else None)
 
-    parser = Parser(tokens)
-    parser.parse()
+    with f, profiler or contextlib.nullcontext():
+        with stage(profiler, 'lex') as record:
+            if args.stream:
+                tokens = Lexer.iterTokens(f)
+            else:
+                lexer = Lexer(f.read())
+                tokens = lexer.lex()
+                record.tokens = len(tokens)
+
+        if args.ast:
+            # Imported here: syntax_tree builds on this module
+            from syntax_tree import TreeParser as parser_class
+        else:
+            parser_class = Parser
+        parser = parser_class(tokens, fold_constants=args.optimize, profiler=profiler,
+                              source=None if args.stream else lexer.sourceCode)
+        parser.parse(optimize=args.optimize, echo=args.echo,
+                     binary_filename="parser_output.bin" if args.binary else None)
+    if profiler is not None:
+        profiler.report()
@@ -0,0 +1,121 @@
+from instructions import InstrTable, OPCODE_CODES, OPCODES, FOLD_OPS, fold_binary
+
+PUSHI = OPCODE_CODES['PUSHI']
+JUMPZ = OPCODE_CODES['JUMPZ']
+JUMP = OPCODE_CODES['JUMP']
+LABEL = OPCODE_CODES['LABEL']
+CALL = OPCODE_CODES['CALL']
+RET = OPCODE_CODES['RET']
+FOLD_CODES = {OPCODE_CODES[op] for op in FOLD_OPS}
+
+
+def optimize(instr_table):
+    """
+    Peephole pass over a finished instruction table. Returns a new table and
+    the number of instructions removed. Addresses are renumbered and every
+    JUMP/JUMPZ/CALL target is remapped to the new address of the
+    instruction it pointed at.
+
+    Rewrites applied until nothing changes:
+      - LABEL is dropped (it is a no-op)
+      - jumps to a JUMP or LABEL are retargeted to the final destination
+      - JUMP to the next instruction is dropped
+      - code after a JUMP or RET is dropped up to the next jump or call
+        target, which also drops functions that are never called
+      - PUSHI a, PUSHI b, <binary op> becomes PUSHI <result>; this covers
+        PUSHI 0, PUSHI k, SUB from a negated literal (never DIV by zero)
+      - PUSHI k, JUMPZ t is dropped for k != 0 and becomes JUMP t for k == 0
+
+    POPM x followed by PUSHM x is left alone: the value must still be stored
+    and the instruction set has no DUP to keep a copy on the stack.
+    """
+    ops = list(instr_table.ops)
+    oprnds = list(instr_table.oprnds)
+    original_count = len(ops)
+    while True:
+        count = len(ops)
+        ops, oprnds = peephole_pass(ops, oprnds)
+        if len(ops) == count:
+            break
+    return InstrTable.from_codes(ops, oprnds), original_count - len(ops)
+
+
+def resolve_jump(ops, oprnds, index):
+    # Follows LABELs and unconditional JUMPs from index to the instruction
+    # control really lands on; a JUMP cycle stops at the first repeat
+    seen = set()
+    while index < len(ops):
+        if ops[index] == LABEL:
+            index += 1
+        elif ops[index] == JUMP and index not in seen:
+            seen.add(index)
+            index = oprnds[index] - 1
+        else:
+            break
+    return index
+
+
+def peephole_pass(ops, oprnds):
+    count = len(ops)
+    # Jump operands are 1-based addresses; work with resolved 0-based indexes
+    jump_targets = {}
+    for index, op in enumerate(ops):
+        if op == JUMP or op == JUMPZ or op == CALL:
+            jump_targets[index] = resolve_jump(ops, oprnds, oprnds[index] - 1)
+    targets = set(jump_targets.values())
+
+    out_ops = []
+    out_oprnds = []
+    # new_index[i] is where old instruction i (or, if it was removed, the
+    # next surviving instruction) ends up
+    new_index = [0] * (count + 1)
+    # Highest output index some jump lands on. Entries at or below it must
+    # stay put, so a rewrite may only drop entries above it.
+    barrier = -1
+    dead = False
+
+    for index in range(count):
+        if index in targets:
+            dead = False
+            barrier = len(out_ops)
+        new_index[index] = len(out_ops)
+        if dead:
+            continue
+        op = ops[index]
+        oprnd = oprnds[index]
+
+        if op == LABEL:
+            continue
+        if op == JUMP or op == JUMPZ or op == CALL:
+            oprnd = jump_targets[index]
+            if op == JUMP and oprnd == index + 1:
+                continue
+
+        foldable = out_ops and len(out_ops) - 1 > barrier and out_ops[-1] == PUSHI
+        if foldable and op in FOLD_CODES and len(out_ops) >= 2 and out_ops[-2] == PUSHI:
+            value = fold_binary(OPCODES[op], out_oprnds[-2], out_oprnds[-1])
+            if value is not None:
+                out_ops.pop()
+                out_oprnds.pop()
+                out_oprnds[-1] = value
+                continue
+        if foldable and op == JUMPZ:
+            if out_oprnds[-1] != 0:
+                out_ops.pop()
+                out_oprnds.pop()
+                continue
+            out_ops[-1] = JUMP
+            out_oprnds[-1] = oprnd
+            dead = True
+            continue
+
+        out_ops.append(op)
+        out_oprnds.append(oprnd)
+        if op == JUMP or op == RET:
+            dead = True
+    new_index[count] = len(out_ops)
+
+    for index, op in enumerate(out_ops):
+        if op == JUMP or op == JUMPZ or op == CALL:
+            out_oprnds[index] = new_index[out_oprnds[index]] + 1
+    return out_ops, out_oprnds
@@ -0,0 +1,171 @@
+import contextlib
+import cProfile
+import sys
+import time
+import tracemalloc
+
+
+class StageRecord:
+    """
+    Measurements for one pipeline stage. Callers fill in tokens and
+    instructions inside the stage; allocated and peak are bytes traced by
+    tracemalloc during the stage and stay None unless allocations are on.
+    """
+    __slots__ = ('name', 'seconds', 'tokens', 'instructions', 'allocated', 'peak')
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.tokens = None
+        self.instructions = None
+        self.allocated = None
+        self.peak = None
+
+
+class Profiler:
+    """
+    Records wall time, token and instruction counts and, optionally,
+    allocations for each stage of a compile:
+
+        profiler = Profiler(rules=True)
+        with profiler:
+            with profiler.stage('lex') as record:
+                tokens = Lexer(source).lex()
+                record.tokens = len(tokens)
+            ...
+        profiler.report()
+
+    on_stage is called with each StageRecord as its stage ends. With
+    rules=True, instrument(parser) wraps the parser's grammar rules and code
+    generation helpers to count calls and time per rule. cprofile_path runs
+    cProfile while the profiler is entered and dumps its stats there.
+    """
+
+    def __init__(self, allocations=False, rules=False, cprofile_path=None, on_stage=None):
+        self.allocations = allocations
+        self.rules = rules
+        self.cprofile_path = cprofile_path
+        self.on_stage = on_stage
+        self.stages = []
+        # {rule: [calls, cumulative seconds, self seconds]}
+        self.rule_times = {}
+        # Time spent in nested instrumented calls, one slot per active call
+        self.rule_stack = []
+        self.cprofile = None
+        self.started_tracing = False
+
+    def __enter__(self):
+        if self.allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        if self.cprofile_path is not None:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.cprofile_path)
+            self.cprofile = None
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        return False
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        record = StageRecord(name)
+        tracing = self.allocations and tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - start
+            if tracing:
+                current, peak = tracemalloc.get_traced_memory()
+                record.allocated = current - before
+                record.peak = peak - before
+            self.stages.append(record)
+            if self.on_stage is not None:
+                self.on_stage(record)
+
+    def instrument(self, parser, names):
+        # Replaces each named method on the parser instance with a timing
+        # wrapper. The recursive descent calls rules through self, so the
+        # instance attributes are picked up without touching the class.
+        if not self.rules:
+            return
+        for name in names:
+            setattr(parser, name, self.timed(name, getattr(parser, name)))
+
+    def timed(self, name, method):
+        entry = self.rule_times.setdefault(name, [0, 0.0, 0.0])
+        children = self.rule_stack
+        active = [0]
+        perf_counter = time.perf_counter
+
+        def wrapper(*args):
+            children.append(0.0)
+            active[0] += 1
+            start = perf_counter()
+            try:
+                return method(*args)
+            finally:
+                elapsed = perf_counter() - start
+                active[0] -= 1
+                entry[0] += 1
+                entry[2] += elapsed - children.pop()
+                # Recursive rules count toward their cumulative time once,
+                # at the outermost call
+                if not active[0]:
+                    entry[1] += elapsed
+                if children:
+                    children[-1] += elapsed
+        return wrapper
+
+    def report(self, stream=None):
+        stream = stream if stream is not None else sys.stderr
+        stream.write(self.report_text())
+
+    def report_text(self):
+        lines = ["Profile"]
+        header = f"{'Stage':<10} {'Seconds':>10} {'Tokens':>10} {'Instrs':>10}"
+        if self.allocations:
+            header += f" {'Allocated':>12} {'Peak':>12}"
+        lines.append(header)
+        total = 0.0
+        for record in self.stages:
+            total += record.seconds
+            line = (f"{record.name:<10} {record.seconds:>10.4f} "
+                    f"{format_count(record.tokens):>10} {format_count(record.instructions):>10}")
+            if self.allocations:
+                line += f" {format_count(record.allocated):>12} {format_count(record.peak):>12}"
+            lines.append(line)
+        lines.append(f"{'total':<10} {total:>10.4f}")
+
+        if self.rule_times:
+            lines.append("")
+            lines.append(f"{'Rule':<28} {'Calls':>10} {'Cumulative':>12} {'Self':>10}")
+            rows = sorted(self.rule_times.items(), key=lambda item: item[1][2], reverse=True)
+            for name, (calls, cumulative, own) in rows:
+                if calls:
+                    lines.append(f"{name:<28} {calls:>10} {cumulative:>12.4f} {own:>10.4f}")
+        if self.cprofile_path is not None:
+            lines.append("")
+            lines.append(f"cProfile stats written to {self.cprofile_path}")
+        return "\n".join(lines) + "\n"
+
+
+def format_count(value):
+    return "-" if value is None else f"{value:,}"
+
+
+def stage(profiler, name):
+    # profiler.stage(name), or a stand-in record when not profiling
+    if profiler is None:
+        return contextlib.nullcontext(StageRecord(name))
+    return profiler.stage(name)
@@ -0,0 +1,159 @@
+import argparse
+import random
+import sys
+
+RELOPS = ['==', '!=', '>', '<', '<=', '=>']
+
+
+class ProgramGenerator:
+    """
+    Seeded generator of valid Simplified Rat25F programs for benchmarks.
+    Programs declare integer and boolean variables and mix assignments,
+    put, get, nested while loops, if/else/fi and compound statements.
+
+    Generated programs also run to completion on the VM: each while loop
+    counts its own counter (one per nesting depth) up to loop_bound,
+    division is only by a non-zero literal, and every integer assignment is
+    followed by v = v - v / 1000 * 1000 so values stay small.
+    """
+
+    def __init__(self, seed=0, integers=8, booleans=2, max_depth=3,
+                 expression_depth=4, loop_bound=3):
+        self.rng = random.Random(seed)
+        self.integers = [f"v{i}" for i in range(integers)]
+        self.booleans = [f"b{i}" for i in range(booleans)]
+        self.counters = [f"c{i}" for i in range(max_depth + 1)]
+        self.max_depth = max_depth
+        self.expression_depth = expression_depth
+        self.loop_bound = loop_bound
+        self.statement_count = 0
+        self.remaining = 0
+
+    def generate(self, statements):
+        """
+        Returns the text of a program with about the given number of
+        statements; statement_count holds the exact number emitted.
+        """
+        self.statement_count = 0
+        self.remaining = statements
+        lines = ["#"]
+        lines.append("integer " + ", ".join(self.integers + self.counters) + ";")
+        if self.booleans:
+            lines.append("boolean " + ", ".join(self.booleans) + ";")
+        while self.remaining > 0:
+            lines.append(self.statement(0))
+        lines.append("#")
+        return "\n".join(lines) + "\n"
+
+    def generate_chain(self, terms):
+        """
+        Returns the text of a program whose one assignment is a flat chain
+        of terms operands joined by + - * /, for checking that long
+        expressions compile without recursing per operand.
+        """
+        self.statement_count = 1
+        operands = [self.integer_primary()]
+        for _ in range(terms - 1):
+            op = self.rng.choice('+-*/')
+            # Divide only by non-zero literals, as in integer_expression
+            operands.append(f"{op} {self.rng.randint(1, 9) if op == '/' else self.integer_primary()}")
+        target = self.integers[0]
+        return (f"#\ninteger {', '.join(self.integers)};\n"
+                f"{target} = {' '.join(operands)};\nput({target});\n#\n")
+
+    def emit(self, count=1):
+        self.statement_count += count
+        self.remaining -= count
+
+    def statement(self, depth):
+        choice = self.rng.random()
+        nested = depth < self.max_depth and self.remaining > 4
+        if nested and choice < 0.1:
+            return self.while_statement(depth)
+        if nested and choice < 0.2:
+            return self.if_statement(depth)
+        if nested and choice < 0.25:
+            self.emit()
+            return "{ " + self.block(depth + 1) + " }"
+        if choice < 0.35:
+            self.emit()
+            return f"put({self.integer_expression(0)});"
+        if choice < 0.4:
+            self.emit()
+            names = self.rng.sample(self.integers, self.rng.randint(1, 2))
+            return f"get({', '.join(names)});"
+        if self.booleans and choice < 0.45:
+            self.emit()
+            value = self.rng.choice(['true', 'false'] + self.booleans)
+            return f"{self.rng.choice(self.booleans)} = {value};"
+        self.emit(2)
+        name = self.rng.choice(self.integers)
+        return (f"{name} = {self.integer_expression(0)}; "
+                f"{name} = {name} - {name} / 1000 * 1000;")
+
+    def block(self, depth):
+        statements = [self.statement(depth)
+                      for _ in range(self.rng.randint(1, 3)) if self.remaining > 0]
+        return " ".join(statements) or "put(0);"
+
+    def while_statement(self, depth):
+        # { c = 0; while (c < N) { ...; c = c + 1; } }
+        self.emit(4)
+        counter = self.counters[depth]
+        body = self.block(depth + 1)
+        bound = self.rng.randint(1, self.loop_bound)
+        return (f"{{ {counter} = 0; while ({counter} < {bound}) "
+                f"{{ {body} {counter} = {counter} + 1; }} }}")
+
+    def if_statement(self, depth):
+        # Branches are compound so an assignment pair counts as one statement
+        self.emit()
+        text = f"if ({self.condition()}) {{ {self.block(depth + 1)} }}"
+        if self.rng.random() < 0.5:
+            return f"{text} else {{ {self.block(depth + 1)} }} fi"
+        return f"{text} fi"
+
+    def condition(self):
+        if self.booleans and self.rng.random() < 0.2:
+            return f"{self.rng.choice(self.booleans)} == {self.rng.choice(['true', 'false'])}"
+        return (f"{self.integer_expression(1)} {self.rng.choice(RELOPS)} "
+                f"{self.integer_expression(1)}")
+
+    def integer_expression(self, depth):
+        choice = self.rng.random()
+        if depth >= self.expression_depth or choice < 0.35:
+            return self.integer_primary()
+        if choice < 0.45:
+            return f"-({self.integer_expression(depth + 1)})"
+        if choice < 0.55:
+            return f"({self.integer_expression(depth + 1)})"
+        if choice < 0.7:
+            # Multiply and divide only by literals to keep values bounded
+            op = self.rng.choice('*/')
+            return f"{self.integer_primary()} {op} {self.rng.randint(1, 9)}"
+        op = self.rng.choice('+-')
+        return f"{self.integer_expression(depth + 1)} {op} {self.integer_expression(depth + 1)}"
+
+    def integer_primary(self):
+        if self.rng.random() < 0.4:
+            return str(self.rng.randint(0, 99))
+        return self.rng.choice(self.integers)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Generate a random Simplified Rat25F program.")
+    arg_parser.add_argument('--statements', type=int, default=100)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--max-depth', type=int, default=3)
+    arg_parser.add_argument('--expression-depth', type=int, default=4)
+    arg_parser.add_argument('-o', '--output', help="output file (default: stdout)")
+    args = arg_parser.parse_args()
+
+    generator = ProgramGenerator(args.seed, max_depth=args.max_depth,
+                                 expression_depth=args.expression_depth)
+    text = generator.generate(args.statements)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
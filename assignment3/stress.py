@@ -0,0 +1,109 @@
+import argparse
+import io
+import sys
+import time
+from lexer import Lexer
+from parser import Parser
+from program_generator import ProgramGenerator
+from syntax_tree import TreeParser
+
+DEFAULT_STATEMENTS = 1000000
+DEFAULT_TERMS = 5000
+# The direct and AST listings are compared on a smaller flat program, since
+# each is compiled four times with its token list held whole
+DEFAULT_COMPARE_STATEMENTS = 20000
+# The flat program is also timed at a half and a quarter of its size.
+# Doubling the input must at most multiply the compile time by this: linear
+# time gives 2, quadratic 4.
+SCALING_SIZES = 3
+MAX_DOUBLING_RATIO = 3.0
+# Everything compiles under this recursion limit. It covers the nesting of
+# one statement, but not recursing once per statement or operand.
+DEFAULT_RECURSION_LIMIT = 100
+
+
+def compile_both(source):
+    """
+    Compiles source with the direct parser and with TreeParser, with and
+    without constant folding. Raises if any compile fails or the two modes
+    produce different listings.
+    """
+    for fold in (False, True):
+        listings = []
+        for parser_class in (Parser, TreeParser):
+            parser = parser_class(Lexer(source).lex(), fold_constants=fold, source=source)
+            parser.rat25f()
+            listings.append(parser.listing_text())
+        if listings[0] != listings[1]:
+            raise Exception(f"Direct and AST listings differ (fold_constants={fold})")
+
+
+def compile_time(parser_class, source):
+    """
+    Seconds parser_class takes to lex and compile source. Tokens are lexed
+    lazily as in --stream, so a large program's token list is never held.
+    """
+    start = time.perf_counter()
+    parser_class(Lexer.iterTokens(io.StringIO(source))).rat25f()
+    return time.perf_counter() - start
+
+
+def check_linear(parser_class, sources):
+    """
+    Compiles sources, each twice the size of the one before, and raises if
+    doubling the input more than MAX_DOUBLING_RATIO times the compile time.
+    Returns the times.
+    """
+    times = [compile_time(parser_class, source) for source in sources]
+    for smaller, larger in zip(times, times[1:]):
+        if larger > smaller * MAX_DOUBLING_RATIO:
+            raise Exception("Compile time grows faster than the input: "
+                            + ", ".join(f"{seconds:.2f}s" for seconds in times))
+    return times
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(
+        description="Check that very long programs and expression chains compile in direct and "
+                    "AST mode, in time linear in their length and without recursing per statement "
+                    "or operand.")
+    arg_parser.add_argument('--statements', type=int, default=DEFAULT_STATEMENTS,
+                            help="statements in the largest flat program timed")
+    arg_parser.add_argument('--compare-statements', type=int, default=DEFAULT_COMPARE_STATEMENTS,
+                            help="statements in the flat program compiled in both modes")
+    arg_parser.add_argument('--terms', type=int, default=DEFAULT_TERMS,
+                            help="operands in the long expression chain")
+    arg_parser.add_argument('--recursion-limit', type=int, default=DEFAULT_RECURSION_LIMIT,
+                            help="Python recursion limit to compile under")
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args()
+
+    # Generated under the default limit; only compiling runs under the lower one
+    sizes = [args.statements >> shift for shift in reversed(range(SCALING_SIZES))]
+    flat = [ProgramGenerator(args.seed, max_depth=0).generate(size) for size in sizes]
+    compared = [
+        (f"flat program of {args.compare_statements} statements",
+         ProgramGenerator(args.seed, max_depth=0).generate(args.compare_statements)),
+        (f"expression chain of {args.terms} operands",
+         ProgramGenerator(args.seed).generate_chain(args.terms)),
+    ]
+    sys.setrecursionlimit(args.recursion_limit)
+    print(f"Recursion limit {args.recursion_limit}")
+
+    failed = 0
+    for name, source in compared:
+        try:
+            compile_both(source)
+            print(f"PASSED  {name}")
+        except Exception as e:
+            failed += 1
+            print(f"FAILED  {name}: {e}")
+    for label, parser_class in (("direct", Parser), ("AST", TreeParser)):
+        name = f"{label} compile of {', '.join(map(str, sizes))} statements"
+        try:
+            times = check_linear(parser_class, flat)
+            print(f"PASSED  {name}: " + ", ".join(f"{seconds:.2f}s" for seconds in times))
+        except Exception as e:
+            failed += 1
+            print(f"FAILED  {name}: {e}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,168 @@
+import sys
+
+# First data address; global identifiers get consecutive addresses from
+# here in declaration order
+MEMORY_BASE = 10000
+
+# Type codes, so type tests during the parse are small-int comparisons.
+# They are distinct bits: OR-ing two operand types gives INTEGER only for
+# two integers and has the BOOLEAN bit set whenever either is boolean.
+# UNKNOWN (no bits) is the result of calling a function before any of its
+# returns has been seen; it is an integer or boolean at run time. How each
+# such result is used is checked once the function's return type is known
+# (see Parser.expect_type).
+UNKNOWN, INTEGER, BOOLEAN, REAL = 0, 1, 2, 4
+TYPE_NAMES = {UNKNOWN: 'unknown', INTEGER: 'integer', BOOLEAN: 'boolean', REAL: 'real'}
+TYPE_CODES = {name: code for code, name in TYPE_NAMES.items()}
+
+
+def assignable(target, source):
+    # Whether a value of type source may be stored in a target slot;
+    # integers widen to real
+    return target == source or source == UNKNOWN or (target == REAL and source == INTEGER)
+
+
+class Symbol:
+    """
+    One declared identifier: its interned name, address, type name and
+    type code. Globals have a memory address; locals (local=True) have an
+    offset from the frame pointer of their function's activation record.
+    position is the index of the declaring identifier in the parser's
+    token stream, when known.
+    """
+    __slots__ = ('name', 'address', 'type', 'type_code', 'local', 'position')
+
+    def __init__(self, name, address, type_, local=False, position=None):
+        self.name = name
+        self.address = address
+        self.type = type_
+        self.type_code = TYPE_CODES[type_]
+        self.local = local
+        self.position = position
+
+
+class Function:
+    """
+    A function: entry is the address of its ENTER instruction and
+    param_types the type codes of its parameters. Both are None until the
+    definition is reached; calls seen before then are kept in calls as
+    (CALL address, argument type codes, token) to be patched. type is the
+    return type code, None until the first return sets it; a later real
+    return widens an integer type unless a call has already used the
+    result as an integer, which sets called. widened is set by such a
+    widening: returns before it leave an integer, so calls convert the
+    result. uses holds (type code, token) for each use of a call result
+    made before type was known, to be checked when it is. position is the
+    index of the name in the definition in the parser's token stream.
+    """
+    __slots__ = ('name', 'entry', 'param_types', 'type', 'called', 'widened', 'calls', 'uses',
+                 'position')
+
+    def __init__(self, name):
+        self.name = name
+        self.entry = None
+        self.param_types = None
+        self.type = None
+        self.called = False
+        self.widened = False
+        self.calls = []
+        self.uses = []
+        self.position = None
+
+
+class SymbolTable:
+    """
+    Identifiers mapped to Symbols, with global addresses handed out
+    contiguously from base. Because they are contiguous, the reverse index
+    from address to Symbol is a list indexed by address - base. Iterating
+    yields the global Symbols in address order.
+
+    enter_scope() opens a function scope whose parameters and locals get
+    frame offsets 0, 1, 2, ... and may shadow globals; exit_scope() closes
+    it and records its Symbols in frames. Both are a list push or pop.
+    lookup() checks open scopes innermost first, so with none open (the
+    global case) it is a single dict probe.
+    """
+
+    def __init__(self, base=MEMORY_BASE):
+        self.base = base
+        self.symbols = {}
+        # Symbol at each global address, indexed by address - base
+        self.by_address = []
+        # Open scopes, innermost last, as (function name, {name: Symbol})
+        self.scopes = []
+        # Closed scopes in the order they closed, as (function name, [Symbol])
+        self.frames = []
+        # Functions by name, in a namespace of their own
+        self.functions = {}
+
+    def enter_scope(self, name):
+        self.scopes.append((name, {}))
+
+    def scope_size(self):
+        # Number of Symbols in the innermost scope
+        return len(self.scopes[-1][1])
+
+    def scope_types(self):
+        # Type codes of the innermost scope's Symbols in offset order
+        return [symbol.type_code for symbol in self.scopes[-1][1].values()]
+
+    def exit_scope(self):
+        # Closes the innermost scope and returns its frame size
+        name, scope = self.scopes.pop()
+        self.frames.append((name, list(scope.values())))
+        return len(scope)
+
+    def function(self, name):
+        # The Function for name, created on first reference
+        function = self.functions.get(name)
+        if function is None:
+            function = self.functions[name] = Function(sys.intern(name))
+        return function
+
+    def insert(self, name, type_, position=None):
+        # Returns the new Symbol, or None if name is already declared in the
+        # innermost scope
+        name = sys.intern(name)
+        if self.scopes:
+            scope = self.scopes[-1][1]
+            if name in scope:
+                return None
+            symbol = Symbol(name, len(scope), type_, True, position)
+            scope[name] = symbol
+            return symbol
+        if name in self.symbols:
+            return None
+        symbol = Symbol(name, self.base + len(self.by_address), type_, position=position)
+        self.symbols[name] = symbol
+        self.by_address.append(symbol)
+        return symbol
+
+    def lookup(self, name):
+        # The Symbol name refers to in the current scope, or None
+        if self.scopes:
+            for _, scope in reversed(self.scopes):
+                symbol = scope.get(name)
+                if symbol is not None:
+                    return symbol
+        return self.symbols.get(name)
+
+    def at(self, address):
+        # The global Symbol at a memory address, or None
+        index = address - self.base
+        if 0 <= index < len(self.by_address):
+            return self.by_address[index]
+        return None
+
+    def name_at(self, address):
+        symbol = self.at(address)
+        return symbol.name if symbol is not None else None
+
+    def __contains__(self, name):
+        return self.lookup(name) is not None
+
+    def __len__(self):
+        return len(self.by_address)
+
+    def __iter__(self):
+        return iter(self.by_address)
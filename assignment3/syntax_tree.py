@@ -0,0 +1,555 @@
+from instructions import OPERAND_MAX
+from parser import Parser
+from symbol_table import INTEGER, BOOLEAN, REAL
+
+# Nodes of the syntax tree TreeParser builds. Each keeps the tokens its
+# checks report errors at, so code generation words errors as the direct
+# parser does. Operators are stored as the op they compile to.
+
+
+class Program:
+    __slots__ = ('functions', 'declarations', 'statements')
+
+    def __init__(self, functions, declarations, statements):
+        self.functions = functions
+        self.declarations = declarations
+        self.statements = statements
+
+
+class FunctionDef:
+    # token is the function's name and position its stream index;
+    # parameters and declarations are lists of Declaration; body is a
+    # Compound
+    __slots__ = ('token', 'position', 'parameters', 'declarations', 'body')
+
+    def __init__(self, token, position, parameters, declarations, body):
+        self.token = token
+        self.position = position
+        self.parameters = parameters
+        self.declarations = declarations
+        self.body = body
+
+
+class Declaration:
+    # names holds (lexeme, stream index, token) per identifier, the token
+    # being where a duplicate declaration is reported
+    __slots__ = ('type', 'names')
+
+    def __init__(self, type_, names):
+        self.type = type_
+        self.names = names
+
+
+class Compound:
+    __slots__ = ('statements',)
+
+    def __init__(self, statements):
+        self.statements = statements
+
+
+class Assign:
+    # token is the target identifier
+    __slots__ = ('token', 'value')
+
+    def __init__(self, token, value):
+        self.token = token
+        self.value = value
+
+
+class If:
+    # orelse is None without an else branch
+    __slots__ = ('condition', 'then', 'orelse')
+
+    def __init__(self, condition, then, orelse):
+        self.condition = condition
+        self.then = then
+        self.orelse = orelse
+
+
+class Return:
+    # token is the first token of value; both are None for a bare return
+    __slots__ = ('token', 'value')
+
+    def __init__(self, token, value):
+        self.token = token
+        self.value = value
+
+
+class Print:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Scan:
+    # tokens are the identifiers read into
+    __slots__ = ('tokens',)
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+
+class While:
+    __slots__ = ('condition', 'body')
+
+    def __init__(self, condition, body):
+        self.condition = condition
+        self.body = body
+
+
+class Condition:
+    # op is EQU, NEQ, GRT, LES, LEQ or GEQ; token is the relational operator
+    __slots__ = ('op', 'token', 'left', 'right')
+
+    def __init__(self, op, token, left, right):
+        self.op = op
+        self.token = token
+        self.left = left
+        self.right = right
+
+
+class Binary:
+    # op is ADD, SUB, MUL or DIV; token is the operator
+    __slots__ = ('op', 'token', 'left', 'right')
+
+    def __init__(self, op, token, left, right):
+        self.op = op
+        self.token = token
+        self.left = left
+        self.right = right
+
+
+class Negate:
+    # token is the '-'
+    __slots__ = ('token', 'operand')
+
+    def __init__(self, token, operand):
+        self.token = token
+        self.operand = operand
+
+
+class Name:
+    __slots__ = ('token',)
+
+    def __init__(self, token):
+        self.token = token
+
+
+class Call:
+    # token is the function's name
+    __slots__ = ('token', 'arguments')
+
+    def __init__(self, token, arguments):
+        self.token = token
+        self.arguments = arguments
+
+
+class Constant:
+    # type is the type code; value an int (1 or 0 for booleans) or a float
+    __slots__ = ('type', 'value')
+
+    def __init__(self, type_, value):
+        self.type = type_
+        self.value = value
+
+
+RELOPS = {'==': 'EQU', '!=': 'NEQ', '>': 'GRT', '<': 'LES', '<=': 'LEQ', '=>': 'GEQ'}
+ARITH_OPS = {'+': 'ADD', '-': 'SUB', '*': 'MUL', '/': 'DIV'}
+
+
+class TreeParser(Parser):
+    """
+    Parser that builds a syntax tree instead of emitting code as it
+    recognizes. It accepts the same programs and raises the same syntax
+    errors; declarations, name lookups and type checks wait for
+    codegen.CodeGenerator, so of a syntax error and an earlier semantic
+    error it reports the syntax error.
+
+    rat25f() leaves the tree in tree and then generates code from it, so
+    instr_table and symbol_table end up as the direct parser leaves them
+    and parse() works unchanged.
+    """
+
+    def __init__(self, tokens, trace='off', trace_sink=None, fold_constants=False, profiler=None,
+                 source=None):
+        super().__init__(tokens, trace, trace_sink, fold_constants, profiler, source)
+        self.tree = None
+
+    def rat25f(self):
+        # Imported here: codegen builds on this module's node classes
+        from codegen import CodeGenerator
+        self.log_production(
+            "<Rat25F> ::= <Opt Function Definitions> # <Opt Declaration List> <Statement List> #")
+        functions = self.opt_function_definitions()
+        if not self.match('SEPARATOR', '#'):
+            self.error("Expected '#' after function definitions")
+        declarations = self.opt_declaration_list()
+        statements = self.statement_list()
+        self.program_end()
+        self.tree = Program(functions, declarations, statements)
+
+        generator = CodeGenerator(self.fold_constants, self.source)
+        try:
+            generator.generate(self.tree)
+        except Exception:
+            self.error_at = generator.error_at
+            raise
+        self.symbol_table = generator.symbol_table
+        self.instr_table = generator.instr_table
+        self.instr_address = generator.instr_address
+
+    def opt_function_definitions(self):
+        if self.current_token and self.current_token[1] == 'function':
+            self.log_production(
+                "<Opt Function Definitions> ::= <Function Definitions>")
+            return self.function_definitions()
+        self.log_production("<Opt Function Definitions> ::= <Empty>")
+        return []
+
+    def function_definitions(self):
+        self.log_production(
+            "<Function Definitions> ::= <Function> <Function Definitions'>")
+        functions = [self.function()]
+        while self.current_token and self.current_token[1] == 'function':
+            self.log_production(
+                "<Function Definitions'> ::= <Function> <Function Definitions'>")
+            functions.append(self.function())
+        self.log_production("<Function Definitions'> ::= <Empty>")
+        return functions
+
+    def function(self):
+        self.log_production(
+            "<Function> ::= function <Identifier> ( <Opt Parameter List> ) <Opt Declaration List> <Body>")
+        if not self.match('KEYWORD', 'function'):
+            self.error("Expected 'function'")
+        if not self.current_token or self.current_token[0] != 'IDENTIFIER':
+            self.error("Expected identifier")
+        token, position = self.current_token, self.pos
+        self.match('IDENTIFIER')
+        if not self.match('SEPARATOR', '('):
+            self.error("Expected '('")
+        parameters = self.opt_parameter_list()
+        if not self.match('SEPARATOR', ')'):
+            self.error("Expected ')'")
+        declarations = self.opt_declaration_list()
+        return FunctionDef(token, position, parameters, declarations, self.body())
+
+    def opt_parameter_list(self):
+        if self.current_token and self.current_token[0] == 'IDENTIFIER':
+            self.log_production("<Opt Parameter List> ::= <Parameter List>")
+            self.log_production(
+                "<Parameter List> ::= <Parameter> <Parameter List'>")
+            parameters = [self.parameter()]
+            while self.match('SEPARATOR', ','):
+                self.log_production(
+                    "<Parameter List'> ::= , <Parameter> <Parameter List'>")
+                parameters.append(self.parameter())
+            self.log_production("<Parameter List'> ::= <Empty>")
+            return parameters
+        self.log_production("<Opt Parameter List> ::= <Empty>")
+        return []
+
+    def parameter(self):
+        # The parameters are declared once the qualifier is read, so
+        # duplicates are reported at the token after it
+        self.log_production("<Parameter> ::= <IDs> <Qualifier>")
+        ids_list = self.ids_parse_only()
+        type_ = self.qualifier()
+        token = self.current_token
+        return Declaration(type_, [(lexeme, position, token) for lexeme, position in ids_list])
+
+    def body(self):
+        self.log_production("<Body> ::= { <Statement List> }")
+        if not self.match('SEPARATOR', '{'):
+            self.error("Expected '{'")
+        statements = self.statement_list()
+        if not self.match('SEPARATOR', '}'):
+            self.error("Expected '}'")
+        return Compound(statements)
+
+    def opt_declaration_list(self):
+        if self.current_token and self.current_token[0] == 'KEYWORD' and self.current_token[1] in ['integer', 'boolean', 'real']:
+            self.log_production(
+                "<Opt Declaration List> ::= <Declaration List>")
+            self.log_production(
+                "<Declaration List> ::= <Declaration> ; <Declaration List'>")
+            declarations = [self.declaration()]
+            if not self.match('SEPARATOR', ';'):
+                self.error("Expected ';'")
+            while self.current_token and self.current_token[0] == 'KEYWORD' and self.current_token[1] in ['integer', 'boolean', 'real']:
+                self.log_production(
+                    "<Declaration List'> ::= <Declaration> ; <Declaration List'>")
+                declarations.append(self.declaration())
+                if not self.match('SEPARATOR', ';'):
+                    self.error("Expected ';'")
+            self.log_production("<Declaration List'> ::= <Empty>")
+            return declarations
+        self.log_production("<Opt Declaration List> ::= <Empty>")
+        return []
+
+    def declaration(self):
+        # Each identifier is declared as it is read, so a duplicate is
+        # reported at the token after it
+        self.log_production("<Declaration> ::= <Qualifier> <IDs>")
+        type_ = self.qualifier()
+        self.log_production("<IDs> ::= <Identifier> <IDs'>")
+        names = []
+        if not (self.current_token and self.current_token[0] == 'IDENTIFIER'):
+            self.error("Expected identifier")
+        while True:
+            lexeme, position = self.current_token[1], self.pos
+            self.match('IDENTIFIER')
+            names.append((lexeme, position, self.current_token))
+            if not self.match('SEPARATOR', ','):
+                break
+            self.log_production("<IDs'> ::= , <Identifier> <IDs'>")
+            if not (self.current_token and self.current_token[0] == 'IDENTIFIER'):
+                self.error("Expected identifier")
+        self.log_production("<IDs'> ::= <Empty>")
+        return Declaration(type_, names)
+
+    def statement_list(self):
+        self.log_production(
+            "<Statement List> ::= <Statement> <Statement List'>")
+        statements = [self.statement()]
+        while self.at_statement_start():
+            self.log_production(
+                "<Statement List'> ::= <Statement> <Statement List'>")
+            statements.append(self.statement())
+        self.log_production("<Statement List'> ::= <Empty>")
+        return statements
+
+    def statement(self):
+        if self.current_token:
+            if self.current_token[1] == '{':
+                self.log_production("<Statement> ::= <Compound>")
+                return self.compound()
+            elif self.current_token[0] == 'IDENTIFIER':
+                self.log_production("<Statement> ::= <Assign>")
+                return self.assign()
+            elif self.current_token[1] == 'if':
+                self.log_production("<Statement> ::= <If>")
+                return self._if()
+            elif self.current_token[1] == 'return':
+                self.log_production("<Statement> ::= <Return>")
+                return self._return()
+            elif self.current_token[1] == 'put':
+                self.log_production("<Statement> ::= <Print>")
+                return self.print_statement()
+            elif self.current_token[1] == 'get':
+                self.log_production("<Statement> ::= <Scan>")
+                return self.scan()
+            elif self.current_token[1] == 'while':
+                self.log_production("<Statement> ::= <While>")
+                return self._while()
+            else:
+                self.error("Invalid statement")
+        else:
+            self.error("Unexpected end of input")
+
+    def compound(self):
+        self.log_production("<Compound> ::= { <Statement List> }")
+        if not self.match('SEPARATOR', '{'):
+            self.error("Expected '{'")
+        statements = self.statement_list()
+        if not self.match('SEPARATOR', '}'):
+            self.error("Expected '}'")
+        return Compound(statements)
+
+    def assign(self):
+        self.log_production("<Assign> ::= <Identifier> = <Expression> ;")
+        if not (self.current_token and self.current_token[0] == 'IDENTIFIER'):
+            self.error("Expected identifier")
+        token = self.current_token
+        self.match('IDENTIFIER')
+        if not self.match('OPERATOR', '='):
+            self.error("Expected '='")
+        value = self.expression()
+        if not self.match('SEPARATOR', ';'):
+            self.error("Expected ';'")
+        return Assign(token, value)
+
+    def _if(self):
+        self.log_production(
+            "<If> ::= if ( <Condition> ) <Statement> <If_Tail>")
+        if not self.match('KEYWORD', 'if'):
+            self.error("Expected 'if'")
+        if not self.match('SEPARATOR', '('):
+            self.error("Expected '('")
+        condition = self.condition()
+        if not self.match('SEPARATOR', ')'):
+            self.error("Expected ')'")
+        then = self.statement()
+        if self.match('KEYWORD', 'else'):
+            self.log_production("<If_Tail> ::= else <Statement> fi")
+            orelse = self.statement()
+            if not self.match('KEYWORD', 'fi'):
+                self.error("Expected 'fi'")
+        elif self.match('KEYWORD', 'fi'):
+            self.log_production("<If_Tail> ::= fi")
+            orelse = None
+        else:
+            self.error("Expected 'fi' or 'else'")
+        return If(condition, then, orelse)
+
+    def _return(self):
+        self.log_production("<Return> ::= return <Return_Tail>")
+        if not self.match('KEYWORD', 'return'):
+            self.error("Expected 'return'")
+        if self.current_token and self.current_token[1] == ';':
+            self.log_production("<Return_Tail> ::= ;")
+            self.match('SEPARATOR', ';')
+            return Return(None, None)
+        self.log_production("<Return_Tail> ::= <Expression> ;")
+        token = self.current_token
+        value = self.expression()
+        if not self.match('SEPARATOR', ';'):
+            self.error("Expected ';'")
+        return Return(token, value)
+
+    def print_statement(self):
+        self.log_production("<Print> ::= put ( <Expression> );")
+        if not self.match('KEYWORD', 'put'):
+            self.error("Expected 'put'")
+        if not self.match('SEPARATOR', '('):
+            self.error("Expected '('")
+        value = self.expression()
+        if not self.match('SEPARATOR', ')'):
+            self.error("Expected ')'")
+        if not self.match('SEPARATOR', ';'):
+            self.error("Expected ';'")
+        return Print(value)
+
+    def scan(self):
+        self.log_production("<Scan> ::= get ( <IDs> );")
+        if not self.match('KEYWORD', 'get'):
+            self.error("Expected 'get'")
+        if not self.match('SEPARATOR', '('):
+            self.error("Expected '('")
+        self.log_production("<IDs> ::= <Identifier> <IDs'>")
+        tokens = []
+        if not (self.current_token and self.current_token[0] == 'IDENTIFIER'):
+            self.error("Expected identifier")
+        while True:
+            tokens.append(self.current_token)
+            self.match('IDENTIFIER')
+            if not self.match('SEPARATOR', ','):
+                break
+            self.log_production("<IDs'> ::= , <Identifier> <IDs'>")
+            if not (self.current_token and self.current_token[0] == 'IDENTIFIER'):
+                self.error("Expected identifier")
+        self.log_production("<IDs'> ::= <Empty>")
+        if not self.match('SEPARATOR', ')'):
+            self.error("Expected ')'")
+        if not self.match('SEPARATOR', ';'):
+            self.error("Expected ';'")
+        return Scan(tokens)
+
+    def _while(self):
+        self.log_production("<While> ::= while ( <Condition> ) <Statement>")
+        if not self.match('KEYWORD', 'while'):
+            self.error("Expected 'while'")
+        if not self.match('SEPARATOR', '('):
+            self.error("Expected '('")
+        condition = self.condition()
+        if not self.match('SEPARATOR', ')'):
+            self.error("Expected ')'")
+        return While(condition, self.statement())
+
+    def condition(self):
+        self.log_production(
+            "<Condition> ::= <Expression> <Relop> <Expression>")
+        left = self.expression()
+        token = self.current_token
+        op = self.relop()
+        return Condition(RELOPS[op], token, left, self.expression())
+
+    def expression(self):
+        self.log_production("<Expression> ::= <Term> <Expression'>")
+        left = self.term()
+        while self.current_token and self.current_token[0] == 'OPERATOR' and self.current_token[1] in ['+', '-']:
+            token = self.current_token
+            op = token[1]
+            self.match('OPERATOR', op)
+            if self.trace_productions:
+                self.log_production(f"<Expression'> ::= {op} <Term> <Expression'>")
+            left = Binary(ARITH_OPS[op], token, left, self.term())
+        self.log_production("<Expression'> ::= <Empty>")
+        return left
+
+    def term(self):
+        self.log_production("<Term> ::= <Factor> <Term'>")
+        left = self.factor()
+        while self.current_token and self.current_token[0] == 'OPERATOR' and self.current_token[1] in ['*', '/']:
+            token = self.current_token
+            op = token[1]
+            self.match('OPERATOR', op)
+            if self.trace_productions:
+                self.log_production(f"<Term'> ::= {op} <Factor> <Term'>")
+            left = Binary(ARITH_OPS[op], token, left, self.factor())
+        self.log_production("<Term'> ::= <Empty>")
+        return left
+
+    def factor(self):
+        if self.current_token and self.current_token[0] == 'OPERATOR' and self.current_token[1] == '-':
+            token = self.current_token
+            self.match('OPERATOR', '-')
+            self.log_production("<Factor> ::= - <Primary>")
+            return Negate(token, self.primary())
+        self.log_production("<Factor> ::= <Primary>")
+        return self.primary()
+
+    def primary(self):
+        if self.current_token and self.current_token[0] == 'IDENTIFIER':
+            self.log_production("<Primary> ::= <Identifier> <Primary_Tail>")
+            token = self.current_token
+            self.match('IDENTIFIER')
+            if self.current_token and self.current_token[1] == '(':
+                self.log_production("<Primary_Tail> ::= ( <Arguments> )")
+                return self.call(token)
+            self.log_production("<Primary_Tail> ::= <Empty>")
+            return Name(token)
+        elif self.current_token and self.current_token[0] == 'INTEGER':
+            value = int(self.current_token[1])
+            if value > OPERAND_MAX:
+                self.error("Integer literal out of range")
+            self.log_production("<Primary> ::= <Integer>")
+            self.match('INTEGER')
+            return Constant(INTEGER, value)
+        elif self.current_token and self.current_token[0] == 'REAL':
+            try:
+                value = float(self.current_token[1])
+            except ValueError:
+                self.error("Invalid real")
+            self.log_production("<Primary> ::= <Real>")
+            self.match('REAL')
+            return Constant(REAL, value)
+        elif self.current_token and self.current_token[1] == 'true':
+            self.log_production("<Primary> ::= true")
+            self.match('KEYWORD', 'true')
+            return Constant(BOOLEAN, 1)
+        elif self.current_token and self.current_token[1] == 'false':
+            self.log_production("<Primary> ::= false")
+            self.match('KEYWORD', 'false')
+            return Constant(BOOLEAN, 0)
+        elif self.current_token and self.current_token[1] == '(':
+            self.log_production("<Primary> ::= ( <Expression> )")
+            self.match('SEPARATOR', '(')
+            value = self.expression()
+            if not self.match('SEPARATOR', ')'):
+                self.error("Expected ')'")
+            return value
+        else:
+            self.error("Invalid primary")
+
+    def call(self, token):
+        self.match('SEPARATOR', '(')
+        arguments = []
+        if not (self.current_token and self.current_token[1] == ')'):
+            arguments.append(self.expression())
+            while self.match('SEPARATOR', ','):
+                arguments.append(self.expression())
+        if not self.match('SEPARATOR', ')'):
+            self.error("Expected ')'")
+        return Call(token, arguments)
@@ -0,0 +1,357 @@
+import argparse
+import sys
+from array import array
+from instructions import InstrTable, MappedListing, OPCODES, OPCODE_CODES, div_trunc, oprnd_to_real
+from lexer import Lexer
+from parser import Parser
+from symbol_table import MEMORY_BASE
+
+# Ops whose operand is a memory address, a frame offset or a jump target
+MEMORY_OPS = {'PUSHM', 'POPM'}
+REAL_MEMORY_OPS = {'PUSHMR', 'POPMR'}
+LOCAL_OPS = {'PUSHL', 'POPL', 'PUSHLR', 'POPLR'}
+JUMP_OPS = {'JUMPZ', 'JUMP', 'CALL'}
+
+# Deepest allowed nesting of CALLs, so runaway recursion stops with an error
+MAX_CALL_DEPTH = 100000
+
+
+def load_listing(path):
+    """
+    Reads an instruction table back from a listing: a .bin file written with
+    a binary listing, which is mapped rather than read (see MappedListing),
+    or a .out file written by Parser.parse. A .out file holding a parser
+    error message raises it instead.
+    """
+    if path.endswith('.bin'):
+        return MappedListing(path).table
+    with open(path, 'r') as f:
+        text = f.read()
+    try:
+        return InstrTable.from_listing(text)
+    except Exception as e:
+        raise Exception(f"{e} in '{path}'") from None
+
+
+def read_fields(stream):
+    # Whitespace-separated input fields from a text stream, read a line at a
+    # time; STDIN converts each to an integer and STDINR to a real
+    for line in stream:
+        yield from line.split()
+
+
+class VM:
+    """
+    Stack machine for the instruction table produced by Parser. Data memory
+    is an array('q') covering every address the program touches, starting at
+    MEMORY_BASE. STDIN reads integers from stdin and STDOUT writes one value
+    per line to stdout; both default to the process streams. The operand
+    stack stays a list: it holds integers and reals together, which one
+    typed array cannot, and an array boxes a value again on every pop.
+    """
+
+    def __init__(self, instr_table, stdin=None, stdout=None):
+        self.instr_table = instr_table
+        self.stdin = stdin if stdin is not None else sys.stdin
+        self.stdout = stdout if stdout is not None else sys.stdout
+        self.stack = []
+
+        # Pre-decode once: memory operands become indexes into self.memory
+        # or self.reals, jump targets become 0-based instruction indexes and
+        # PUSHR operands become floats. The opcodes are only read, so a
+        # mapped table's are used in place.
+        self.ops = instr_table.ops
+        self.oprnds = instr_table.oprnds.tolist()
+        memory_codes = {OPCODE_CODES[op] for op in MEMORY_OPS}
+        real_memory_codes = {OPCODE_CODES[op] for op in REAL_MEMORY_OPS}
+        local_codes = {OPCODE_CODES[op] for op in LOCAL_OPS}
+        jump_codes = {OPCODE_CODES[op] for op in JUMP_OPS}
+        enter_code = OPCODE_CODES['ENTER']
+        pushr_code = OPCODE_CODES['PUSHR']
+        memory_size = 0
+        reals_size = 0
+        locals_size = 0
+        frame_sizes = set()
+        for index, code in enumerate(self.ops):
+            oprnd = self.oprnds[index]
+            if code in memory_codes or code in real_memory_codes:
+                if oprnd < MEMORY_BASE:
+                    raise Exception(f"VM error at address {index + 1}: Invalid memory address {oprnd}")
+                self.oprnds[index] = oprnd - MEMORY_BASE
+                if code in memory_codes:
+                    memory_size = max(memory_size, oprnd - MEMORY_BASE + 1)
+                else:
+                    reals_size = max(reals_size, oprnd - MEMORY_BASE + 1)
+            elif code == pushr_code:
+                self.oprnds[index] = oprnd_to_real(oprnd)
+            elif code in local_codes:
+                if oprnd < 0:
+                    raise Exception(f"VM error at address {index + 1}: Invalid local offset {oprnd}")
+                locals_size = max(locals_size, oprnd + 1)
+            elif code in jump_codes:
+                if not 1 <= oprnd <= len(self.ops) + 1:
+                    raise Exception(f"VM error at address {index + 1}: Invalid jump target {oprnd}")
+                self.oprnds[index] = oprnd - 1
+            elif code == enter_code:
+                if oprnd < 0:
+                    raise Exception(f"VM error at address {index + 1}: Invalid frame size {oprnd}")
+                frame_sizes.add(oprnd)
+        # Integers and booleans are stored in array('q'), reals in a separate
+        # array('d'), both indexed by address - MEMORY_BASE
+        self.memory = array('q', bytes(8 * memory_size))
+        self.reals = array('d', bytes(8 * reals_size))
+        # Activation records are windows of one array of local slots (with a
+        # parallel array for real locals); frames are allocated and released
+        # by moving the frame pointer, never copied
+        self.locals = array('q', bytes(8 * locals_size))
+        self.local_reals = array('d', bytes(8 * locals_size))
+        # Zeroed frame of each size ENTER uses, copied in to clear a new frame
+        self.zero_frames = {size: (array('q', bytes(8 * size)), array('d', bytes(8 * size)))
+                            for size in frame_sizes}
+
+    def read(self, address):
+        return self.memory[address - MEMORY_BASE]
+
+    def read_real(self, address):
+        return self.reals[address - MEMORY_BASE]
+
+    def run(self):
+        stack = self.stack
+        push = stack.append
+        pop = stack.pop
+        memory = self.memory
+        reals = self.reals
+        local_slots = self.locals
+        local_reals = self.local_reals
+        zero_frames = self.zero_frames
+        inputs = read_fields(self.stdin)
+        write = self.stdout.write
+        # Return address and caller frame pointer of each active CALL
+        calls = []
+        # Frame pointer and first free local slot
+        fp = 0
+        top = 0
+
+        # Each handler takes (operand, pc) and returns the next pc
+        def pushi(x, pc):
+            push(x)
+            return pc + 1
+
+        def pushm(x, pc):
+            push(memory[x])
+            return pc + 1
+
+        def popm(x, pc):
+            memory[x] = pop()
+            return pc + 1
+
+        def pushl(x, pc):
+            push(local_slots[fp + x])
+            return pc + 1
+
+        def popl(x, pc):
+            local_slots[fp + x] = pop()
+            return pc + 1
+
+        def pushmr(x, pc):
+            push(reals[x])
+            return pc + 1
+
+        def popmr(x, pc):
+            reals[x] = pop()
+            return pc + 1
+
+        def pushlr(x, pc):
+            push(local_reals[fp + x])
+            return pc + 1
+
+        def poplr(x, pc):
+            local_reals[fp + x] = pop()
+            return pc + 1
+
+        def call(x, pc):
+            if len(calls) >= MAX_CALL_DEPTH:
+                raise Exception(f"VM error at address {pc + 1}: Call stack overflow")
+            calls.append((pc + 1, fp))
+            return x
+
+        def enter(x, pc):
+            # The new frame starts at the caller's first free slot
+            nonlocal fp, top
+            fp = top
+            top += x
+            if top > len(local_slots):
+                grow = bytes(8 * max(top - len(local_slots), len(local_slots)))
+                local_slots.frombytes(grow)
+                local_reals.frombytes(grow)
+            local_slots[fp:top], local_reals[fp:top] = zero_frames[x]
+            return pc + 1
+
+        def ret(x, pc):
+            # The return value stays on the operand stack; RET with no
+            # active CALL halts
+            nonlocal fp, top
+            if not calls:
+                return end
+            top = fp
+            pc, fp = calls.pop()
+            return pc
+
+        def stdin(x, pc):
+            value = next(inputs, None)
+            if value is None:
+                raise Exception(f"VM error at address {pc + 1}: STDIN past end of input")
+            push(int(value))
+            return pc + 1
+
+        def stdinr(x, pc):
+            value = next(inputs, None)
+            if value is None:
+                raise Exception(f"VM error at address {pc + 1}: STDIN past end of input")
+            push(float(value))
+            return pc + 1
+
+        def itor(x, pc):
+            push(float(pop()))
+            return pc + 1
+
+        def stdout(x, pc):
+            write(f"{pop()}\n")
+            return pc + 1
+
+        def add(x, pc):
+            b = pop()
+            push(pop() + b)
+            return pc + 1
+
+        def sub(x, pc):
+            b = pop()
+            push(pop() - b)
+            return pc + 1
+
+        def mul(x, pc):
+            b = pop()
+            push(pop() * b)
+            return pc + 1
+
+        def div(x, pc):
+            b = pop()
+            a = pop()
+            if b == 0:
+                raise Exception(f"VM error at address {pc + 1}: Division by zero")
+            push(div_trunc(a, b))
+            return pc + 1
+
+        def divr(x, pc):
+            b = pop()
+            a = pop()
+            if b == 0:
+                raise Exception(f"VM error at address {pc + 1}: Division by zero")
+            push(a / b)
+            return pc + 1
+
+        def grt(x, pc):
+            b = pop()
+            push(1 if pop() > b else 0)
+            return pc + 1
+
+        def les(x, pc):
+            b = pop()
+            push(1 if pop() < b else 0)
+            return pc + 1
+
+        def equ(x, pc):
+            b = pop()
+            push(1 if pop() == b else 0)
+            return pc + 1
+
+        def neq(x, pc):
+            b = pop()
+            push(1 if pop() != b else 0)
+            return pc + 1
+
+        def geq(x, pc):
+            b = pop()
+            push(1 if pop() >= b else 0)
+            return pc + 1
+
+        def leq(x, pc):
+            b = pop()
+            push(1 if pop() <= b else 0)
+            return pc + 1
+
+        def jumpz(x, pc):
+            return x if pop() == 0 else pc + 1
+
+        def jump(x, pc):
+            return x
+
+        def label(x, pc):
+            return pc + 1
+
+        handlers = {
+            'PUSHI': pushi, 'PUSHM': pushm, 'POPM': popm,
+            'STDIN': stdin, 'STDOUT': stdout,
+            'ADD': add, 'SUB': sub, 'MUL': mul, 'DIV': div,
+            'GRT': grt, 'LES': les, 'EQU': equ, 'NEQ': neq,
+            'GEQ': geq, 'LEQ': leq,
+            'JUMPZ': jumpz, 'JUMP': jump, 'LABEL': label,
+            'PUSHL': pushl, 'POPL': popl,
+            'CALL': call, 'ENTER': enter, 'RET': ret,
+            # A real operand makes Python's + - * and comparisons produce a
+            # real, so the real ops share the integer handlers except DIVR
+            'PUSHR': pushi, 'PUSHMR': pushmr, 'POPMR': popmr,
+            'PUSHLR': pushlr, 'POPLR': poplr, 'STDINR': stdinr, 'ITOR': itor,
+            'ADDR': add, 'SUBR': sub, 'MULR': mul, 'DIVR': divr,
+            'GRTR': grt, 'LESR': les, 'EQUR': equ, 'NEQR': neq,
+            'GEQR': geq, 'LEQR': leq,
+        }
+        # Dispatch table indexed by opcode code, resolved per instruction up
+        # front so the loop is one list index and one call per step
+        dispatch = [handlers[op] for op in OPCODES]
+        code = [dispatch[op] for op in self.ops]
+        oprnds = self.oprnds
+        end = len(code)
+
+        pc = 0
+        try:
+            while pc < end:
+                pc = code[pc](oprnds[pc], pc)
+        except IndexError:
+            raise Exception(f"VM error at address {pc + 1}: Stack underflow") from None
+        except OverflowError:
+            # A value stored into memory or a local slot must fit an int64
+            raise Exception(f"VM error at address {pc + 1}: Integer out of range") from None
+        except ValueError as e:
+            # Only STDIN and STDINR convert text
+            raise Exception(f"VM error at address {pc + 1}: Invalid input ({e})") from None
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Run a Rat25F program on the stack machine.")
+    arg_parser.add_argument('filename', help="a .rat25 source, .out listing or .bin binary listing")
+    arg_parser.add_argument('--listing', action='store_true',
+                            help="print a .bin file's listing from the mapped file instead of running it")
+    args = arg_parser.parse_args()
+    if args.listing and not args.filename.endswith('.bin'):
+        arg_parser.error("--listing takes a .bin file")
+
+    filename = args.filename
+    try:
+        if args.listing:
+            sys.stdout.write(MappedListing(filename).listing_text())
+            sys.exit(0)
+        if filename.endswith('.rat25'):
+            with open(filename, 'r') as f:
+                parser = Parser(Lexer(f.read()).lex())
+            parser.rat25f()
+            instr_table = parser.instr_table
+        else:
+            instr_table = load_listing(filename)
+        VM(instr_table).run()
+    except FileNotFoundError:
+        print(f"Error: File '{filename}' not found.")
+        sys.exit(1)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)